@@ -0,0 +1,311 @@
+# letter_baseline.py - The leave letter renderer used before templates/leave_letter.html,
+# kept unchanged as the baseline for 'flask bench-letter'. Not used by the app.
+from datetime import datetime
+
+
+def generate_enhanced_leave_letter(user, leave_request, past_leaves, total_medical, total_casual, total_earned):
+    """Generate a comprehensive leave letter with past records"""
+
+    # Calculate current leave duration
+    if leave_request.leave_type == 'half_day':
+        current_duration = ((leave_request.end_date - leave_request.start_date).days + 1) * 0.5
+        duration_text = f"{current_duration} days (Half Day)"
+    else:
+        current_duration = (leave_request.end_date - leave_request.start_date).days + 1
+        duration_text = f"{current_duration} days"
+
+    current_date = datetime.now().strftime("%d/%m/%Y")
+
+    # Generate past leaves table
+    past_leaves_table = ""
+    for i, past_leave in enumerate(past_leaves[:10]):  # Last 10 leaves
+        if past_leave.leave_type == 'half_day':
+            past_duration = ((past_leave.end_date - past_leave.start_date).days + 1) * 0.5
+        else:
+            past_duration = (past_leave.end_date - past_leave.start_date).days + 1
+
+        past_leaves_table += f"""
+        <tr>
+            <td>{i + 1}</td>
+            <td>{past_leave.start_date.strftime('%d/%m/%Y')}</td>
+            <td>{past_leave.end_date.strftime('%d/%m/%Y')}</td>
+            <td>{past_duration}</td>
+            <td>{past_leave.leave_category.title()}</td>
+            <td>{past_leave.leave_type.replace('_', ' ').title()}</td>
+            <td>{past_leave.reason[:50]}{'...' if len(past_leave.reason) > 50 else ''}</td>
+        </tr>
+        """
+
+    # If no past leaves
+    if not past_leaves_table:
+        past_leaves_table = """
+        <tr>
+            <td colspan="7" class="text-center">No previous leave records found for this academic year</td>
+        </tr>
+        """
+
+    letter_html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>Leave Application - {user.full_name}</title>
+        <style>
+            body {{
+                font-family: 'Arial', sans-serif;
+                margin: 40px;
+                line-height: 1.6;
+                color: #000;
+                background: #fff;
+            }}
+            .letter-container {{
+                max-width: 1000px;
+                margin: 0 auto;
+                padding: 20px;
+                border: 1px solid #ddd;
+                background: white;
+            }}
+            .header {{
+                text-align: center;
+                margin-bottom: 30px;
+                border-bottom: 2px solid #000;
+                padding-bottom: 20px;
+            }}
+            .college-name {{
+                font-size: 22px;
+                font-weight: bold;
+                margin-bottom: 5px;
+                color: #2c3e50;
+            }}
+            .address {{
+                font-size: 12px;
+                margin-bottom: 10px;
+                color: #7f8c8d;
+            }}
+            .content {{
+                margin: 30px 0;
+            }}
+            .subject {{
+                font-weight: bold;
+                margin: 20px 0;
+                text-decoration: underline;
+                font-size: 16px;
+            }}
+            .footer {{
+                margin-top: 50px;
+            }}
+            .signature {{
+                margin-top: 80px;
+            }}
+            table {{
+                width: 100%;
+                border-collapse: collapse;
+                margin: 15px 0;
+                font-size: 12px;
+            }}
+            th, td {{
+                padding: 8px;
+                border: 1px solid #000;
+                text-align: left;
+            }}
+            th {{
+                background-color: #f2f2f2;
+                font-weight: bold;
+            }}
+            .section-title {{
+                background: #2c3e50;
+                color: white;
+                padding: 10px;
+                margin: 20px 0 10px 0;
+                font-weight: bold;
+            }}
+            .stats-grid {{
+                display: grid;
+                grid-template-columns: repeat(3, 1fr);
+                gap: 10px;
+                margin: 15px 0;
+            }}
+            .stat-card {{
+                border: 1px solid #ddd;
+                padding: 10px;
+                text-align: center;
+                background: #f8f9fa;
+            }}
+            .stat-number {{
+                font-size: 18px;
+                font-weight: bold;
+                color: #2c3e50;
+            }}
+            .print-btn {{
+                position: fixed;
+                top: 20px;
+                right: 20px;
+                padding: 10px 20px;
+                background: #2c3e50;
+                color: white;
+                border: none;
+                border-radius: 5px;
+                cursor: pointer;
+                z-index: 1000;
+            }}
+            @media print {{
+                body {{ margin: 0; }}
+                .letter-container {{ border: none; padding: 0; }}
+                .print-btn {{ display: none; }}
+            }}
+        </style>
+    </head>
+    <body>
+        <button class="print-btn" onclick="window.print()">🖨️ Print Letter</button>
+
+        <div class="letter-container">
+            <!-- College Header -->
+            <div class="header">
+                <div class="college-name">Pillai College of Engineering (Autonomous)</div>
+                <div class="address">
+                    Dr. K. M. Vasudevan Pillai Campus<br>
+                    Plot No. 10, Sector 16, New Panvel,<br>
+                    Navi Mumbai, Mumbai – 410 206<br>
+                    Email: pce@mes.ac.in | Website: www.pce.ac.in
+                </div>
+            </div>
+
+            <div class="content">
+                <!-- Date and To Section -->
+                <p><strong>Date:</strong> {current_date}</p>
+                <p><strong>To,</strong><br>
+                The Head of Department<br>
+                {user.department} Department<br>
+                Pillai College of Engineering (Autonomous)<br>
+                New Panvel, Navi Mumbai</p>
+
+                <!-- Subject -->
+                <p class="subject">Subject: Application for {leave_request.leave_category.title()} Leave</p>
+
+                <!-- Salutation -->
+                <p><strong>Respected Sir/Madam,</strong></p>
+
+                <!-- Main Content -->
+                <p>I, <strong>{user.full_name}</strong>, Faculty in the <strong>{user.department}</strong> Department, 
+                hereby request your kind permission to grant me {leave_request.leave_category} leave for 
+                <strong>{duration_text}</strong> from <strong>{leave_request.start_date.strftime('%d/%m/%Y')}</strong> to 
+                <strong>{leave_request.end_date.strftime('%d/%m/%Y')}</strong>.</p>
+
+                <!-- Current Leave Details -->
+                <div class="section-title">CURRENT LEAVE APPLICATION DETAILS</div>
+                <table>
+                    <tr>
+                        <td><strong>Faculty Name</strong></td>
+                        <td>{user.full_name}</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Department</strong></td>
+                        <td>{user.department}</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Employee ID</strong></td>
+                        <td>{user.username}</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Leave Category</strong></td>
+                        <td>{leave_request.leave_category.title()} Leave</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Leave Type</strong></td>
+                        <td>{leave_request.leave_type.replace('_', ' ').title()}</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Duration</strong></td>
+                        <td>{leave_request.start_date.strftime('%d/%m/%Y')} to {leave_request.end_date.strftime('%d/%m/%Y')} ({duration_text})</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Reason</strong></td>
+                        <td>{leave_request.reason}</td>
+                    </tr>
+                </table>
+
+                <!-- Leave Statistics -->
+                <div class="section-title">LEAVE UTILIZATION SUMMARY (ACADEMIC YEAR {datetime.now().year})</div>
+                <div class="stats-grid">
+                    <div class="stat-card">
+                        <div class="stat-number">{total_medical}</div>
+                        <div>Medical Leaves Taken</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-number">{total_casual}</div>
+                        <div>Casual Leaves Taken</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-number">{total_earned}</div>
+                        <div>Earned Leaves Taken</div>
+                    </div>
+                </div>
+
+                <!-- Past Leave History -->
+                <div class="section-title">PREVIOUS LEAVE HISTORY (LAST 10 RECORDS)</div>
+                <table>
+                    <thead>
+                        <tr>
+                            <th>#</th>
+                            <th>Start Date</th>
+                            <th>End Date</th>
+                            <th>Days</th>
+                            <th>Category</th>
+                            <th>Type</th>
+                            <th>Reason</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {past_leaves_table}
+                    </tbody>
+                </table>
+
+                <!-- Assurance and Closing -->
+                <p>I assure you that I have made necessary arrangements for my academic responsibilities 
+                to continue smoothly during my absence. All pending work and classes will be managed 
+                as per the department's guidelines.</p>
+
+                <p>Kindly grant me the leave for the mentioned period.</p>
+
+                <div class="signature">
+                    <p>Thanking you,</p>
+                    <br><br>
+                    <p><strong>{user.full_name}</strong><br>
+                    Faculty, {user.department}<br>
+                    Pillai College of Engineering</p>
+                </div>
+            </div>
+
+            <!-- Office Use Section -->
+            <div class="footer">
+                <hr>
+                <div class="section-title">FOR OFFICE USE ONLY</div>
+                <table>
+                    <tr>
+                        <td width="30%"><strong>Leave Approved:</strong></td>
+                        <td>
+                            □ Yes □ No<br>
+                            <strong>Status:</strong> {leave_request.status}<br>
+                            {f"<strong>Approved On:</strong> {leave_request.approved_at.strftime('%d/%m/%Y')}" if leave_request.approved_at else ""}
+                        </td>
+                    </tr>
+                    <tr>
+                        <td><strong>Remarks:</strong></td>
+                        <td>{leave_request.admin_comments if leave_request.admin_comments else "_________________________________"}</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Authorized Signature:</strong></td>
+                        <td>_________________________________</td>
+                    </tr>
+                    <tr>
+                        <td><strong>Date:</strong></td>
+                        <td>_________________________________</td>
+                    </tr>
+                </table>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+    return letter_html
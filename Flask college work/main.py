@@ -1,22 +1,153 @@
 # main.py - Enhanced Flask application for Faculty Leave Management System
 import os
+import re
+import io
+import sys
+import gzip
+import hashlib
+import mimetypes
+import socket
+import queue
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+import smtplib
+import time
+import random
+import traceback
+import tracemalloc
+import functools
+import threading
+import cProfile
+import pstats
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+from email.message import EmailMessage
+from flask import (Flask, render_template, stream_template, request, redirect, url_for, flash, session,
+                   send_from_directory, make_response, g, has_app_context, abort)
+from itsdangerous import URLSafeSerializer, BadSignature
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as RoutingSession
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
 from datetime import datetime, date
 import calendar
 from datetime import timedelta
 import json
-from sqlalchemy import text
+import click
+from sqlalchemy import text, create_engine
+
+try:
+    import brotli
+except ImportError:  # optional, build-assets then only writes .gz files
+    brotli = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key_here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///faculty_leaves.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///faculty_leaves.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Department sharding: extra databases as {shard: uri} and {department: shard}.
+# Departments without an entry, and everything when no shards are configured,
+# live in SQLALCHEMY_DATABASE_URI (the 'default' shard).
+# Assigning a department that already has accounts does not move them: first
+# copy its users and their leave_request, archived_leave_request, letter_index
+# and job rows into the shard database and delete them from the old one, then
+# set DEPARTMENT_SHARDS. Until then the seed refuses to create the accounts
+# again in the new shard and logs an error for each.
+app.config['SQLALCHEMY_BINDS'] = json.loads(os.environ.get('SHARD_DATABASES', '{}'))
+app.config['DEPARTMENT_SHARDS'] = json.loads(os.environ.get('DEPARTMENT_SHARDS', '{}'))
+
+# Academic year rollover
+app.config['EARNED_LEAVE_CARRY_FORWARD_CAP'] = 30
+app.config['ROLLOVER_CHUNK_SIZE'] = 5000
+app.config['ARCHIVE_CHUNK_SIZE'] = 5000
+
+# Import from the pre-v2 portal database (faculty / leave_type / leave_request)
+app.config['LEGACY_DATABASE'] = os.path.join(app.instance_path, 'faculty_portal.db')
+app.config['LEGACY_IMPORT_CHUNK_SIZE'] = 5000
+
+# Background jobs and email
+app.config['LETTERS_FOLDER'] = os.path.join(app.root_path, 'letters')
+app.config['LETTER_STORE_FOLDER'] = os.path.join(app.config['LETTERS_FOLDER'], 'store')
+app.config['LETTER_RETENTION_DAYS'] = 365
+app.config['JOB_LEASE_SECONDS'] = 300
+app.config['JOB_MAX_ATTEMPTS'] = 5
+app.config['JOB_RETRY_BASE_SECONDS'] = 30
+app.config['JOB_POLL_INTERVAL'] = 2
+app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'localhost')
+app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', 1025))
+app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@pce.edu')
+
+# Admin search and queues
+app.config['SEARCH_RESULTS_PER_PAGE'] = 25
+app.config['PENDING_REQUESTS_PER_PAGE'] = 50
+
+# Admin analytics: the rollup re-reads rows changed this long before the last
+# watermark, so writes that committed late are not missed
+app.config['ANALYTICS_WATERMARK_OVERLAP_SECONDS'] = 300
+# The cube is refreshed by run-worker (or refresh-analytics), never on page views
+app.config['ANALYTICS_REFRESH_SECONDS'] = 60
+
+# Calendar feeds: how far back a feed reaches, how long clients may reuse it,
+# and how many feeds/events each worker keeps rendered
+app.config['CALENDAR_FEED_HISTORY_DAYS'] = 365
+app.config['CALENDAR_FEED_MAX_AGE'] = 300
+app.config['CALENDAR_FEED_CACHE_SIZE'] = 500
+app.config['CALENDAR_EVENT_CACHE_SIZE'] = 20000
+
+# Request profiling (off unless enabled here, by PROFILE_ENABLED=1 or from the
+# admin Profiler page, whose settings are kept in PROFILE_SETTINGS_FILE)
+app.config['PROFILE_ENABLED'] = os.environ.get('PROFILE_ENABLED') == '1'
+app.config['PROFILE_MODE'] = 'sample'  # 'sample' -> collapsed stacks, 'cprofile' -> pstats
+app.config['PROFILE_SAMPLE_RATE'] = 0.0
+app.config['PROFILE_ROUTES'] = []
+app.config['PROFILE_USERS'] = []
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_FOLDER'] = os.path.join(app.instance_path, 'profiles')
+app.config['PROFILE_MAX_FILES'] = 50
+app.config['PROFILE_SETTINGS_FILE'] = os.path.join(app.instance_path, 'profiling.json')
+
+# Live updates: /events streams queue changes from this worker's event bus; events
+# written by other workers reach it through each shard's queue_event table. Streams
+# end after LIVE_STREAM_SECONDS so sync workers are freed, and browsers reconnect.
+app.config['LIVE_POLL_INTERVAL'] = 1
+app.config['LIVE_HEARTBEAT_SECONDS'] = 15
+app.config['LIVE_STREAM_SECONDS'] = 300
+app.config['LIVE_REPLAY_SIZE'] = 500
+app.config['LIVE_QUEUE_SIZE'] = 100
+app.config['LIVE_COUNTER_RESEED_SECONDS'] = 300
+app.config['LIVE_EVENT_RETENTION_SECONDS'] = 3600
+
+# Static assets and response compression
+app.config['ASSETS_FOLDER'] = os.path.join(app.static_folder, 'dist')
+app.config['ASSETS_MAX_AGE'] = 365 * 24 * 60 * 60
+app.config['PRECOMPRESS_EXTENSIONS'] = {'.css', '.js', '.svg', '.html', '.json', '.txt'}
+app.config['COMPRESS_MIMETYPES'] = {'text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript'}
+app.config['COMPRESS_MIN_SIZE'] = 1024
+app.config['COMPRESS_LEVEL'] = 6
+
+# Compiled templates are cached on disk so new workers skip the Jinja compile step
+app.config['JINJA_BYTECODE_CACHE_DIR'] = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(app.config['JINJA_BYTECODE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+DEFAULT_SHARD = 'default'
+LEAVE_CATEGORIES = ('medical', 'casual', 'earned')
+
+
+class ShardSession(RoutingSession):
+    """Session that sends every query to the shard selected for the current context"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get('shard', DEFAULT_SHARD) != DEFAULT_SHARD:
+            return db.engines[g.shard]
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': ShardSession})
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 
@@ -27,7 +158,7 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
-    department = db.Column(db.String(100), nullable=False)
+    department = db.Column(db.String(100), nullable=False, index=True)
 
     # Leave balances
     medical_leave_total = db.Column(db.Integer, default=10)
@@ -42,6 +173,14 @@ class User(UserMixin, db.Model):
     earned_leave_used = db.Column(db.Integer, default=0)
     earned_leave_left = db.Column(db.Integer, default=0)
 
+    # Days held by pending requests, so the balance cannot be over-committed
+    medical_leave_reserved = db.Column(db.Float, default=0.0)
+    casual_leave_reserved = db.Column(db.Float, default=0.0)
+    earned_leave_reserved = db.Column(db.Float, default=0.0)
+
+    # Secret part of the calendar feed URLs; rotating it revokes old links
+    calendar_token = db.Column(db.String(32), nullable=True)
+
     # Overwork tracking
     overwork_hours = db.Column(db.Float, default=0.0)
     pending_overwork_hours = db.Column(db.Float, default=0.0)
@@ -52,6 +191,14 @@ class User(UserMixin, db.Model):
 
 
 class LeaveRequest(db.Model):
+    __table_args__ = (
+        db.Index('ix_leave_request_status_created_at', 'status', 'created_at'),
+        db.Index('ix_leave_request_status_start_date', 'status', 'start_date'),
+        db.Index('ix_leave_request_user_id_status', 'user_id', 'status'),
+        db.Index('ix_leave_request_updated_at', 'updated_at'),
+        db.Index('ix_leave_request_user_id_start_date', 'user_id', 'start_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     start_date = db.Column(db.Date, nullable=False)
@@ -64,6 +211,7 @@ class LeaveRequest(db.Model):
     approved_at = db.Column(db.DateTime, nullable=True)
     letter_path = db.Column(db.String(200), nullable=True)
     admin_comments = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     @property
     def duration(self):
@@ -73,11 +221,201 @@ class LeaveRequest(db.Model):
         return days
 
 
+class ArchivedLeaveRequest(db.Model):
+    """Decided leave requests of closed years, moved out of leave_request by archive-leaves"""
+    __table_args__ = (
+        db.Index('ix_archived_leave_request_user_id_start_date', 'user_id', 'start_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False, index=True)
+    reason = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20))
+    leave_type = db.Column(db.String(20))
+    leave_category = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    approved_at = db.Column(db.DateTime, nullable=True)
+    letter_path = db.Column(db.String(200), nullable=True)
+    admin_comments = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    duration = LeaveRequest.duration
+
+
+class LetterIndex(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('leave_request.id'), nullable=False, index=True)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    original_size = db.Column(db.Integer, nullable=False)
+    stored_size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), default='queued', index=True)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=5)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    lease_until = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(100), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class LeaveRollup(db.Model):
+    """One cell of the leave analytics cube; measures are plain sums so cells and shards add up"""
+    __table_args__ = (
+        db.UniqueConstraint('department', 'leave_category', 'leave_type', 'year', 'month', 'status',
+                            name='uq_leave_rollup_cell'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    department = db.Column(db.String(100), nullable=False)
+    leave_category = db.Column(db.String(20), nullable=False)
+    leave_type = db.Column(db.String(20), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    request_count = db.Column(db.Integer, default=0)
+    total_days = db.Column(db.Float, default=0.0)
+    turnaround_seconds = db.Column(db.Float, default=0.0)
+    turnaround_count = db.Column(db.Integer, default=0)
+
+
+class RollupWatermark(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    refreshed_through = db.Column(db.DateTime, nullable=False)
+
+
+class ImportCheckpoint(db.Model):
+    source = db.Column(db.String(255), primary_key=True)
+    entity = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class QueueEvent(db.Model):
+    """Change log of the pending queue, relayed by every worker to its live streams"""
+    id = db.Column(db.Integer, primary_key=True)
+    origin = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
 
+# Sharding
+def shard_keys():
+    return [DEFAULT_SHARD] + list(app.config['SQLALCHEMY_BINDS'])
+
+
+def shard_for_department(department):
+    return app.config['DEPARTMENT_SHARDS'].get(department, DEFAULT_SHARD)
+
+
+def switch_shard(shard):
+    """Point db.session at another shard
+
+    The same primary key exists in every shard, so pending changes are flushed
+    to the old shard and the identity map is cleared before switching.
+    """
+    if g.get('shard', DEFAULT_SHARD) != shard:
+        db.session.flush()
+        db.session.expunge_all()
+    g.shard = shard
+
+
+@contextmanager
+def use_shard(shard):
+    """Route db.session to the given shard for the duration of the block"""
+    previous = g.get('shard', DEFAULT_SHARD)
+    switch_shard(shard)
+    try:
+        yield
+    except BaseException:
+        db.session.expunge_all()
+        g.shard = previous
+        raise
+    switch_shard(previous)
+
+
+@contextmanager
+def scratch_shard(name='scratch'):
+    """Route db.session to a throwaway in-memory database with the full schema"""
+    db.engines[name] = create_engine('sqlite://')
+    db.metadata.create_all(db.engines[name])
+    try:
+        with use_shard(name):
+            yield
+    finally:
+        db.session.close()
+        db.engines.pop(name).dispose()
+
+
+def fan_out(func, *args, **kwargs):
+    """Call func once per shard, in parallel, and return [(shard, result), ...]
+
+    Each call runs in its own app context and session, so func must not rely on
+    the current request and its ORM results should be read, not modified.
+    """
+    shards = shard_keys()
+    if len(shards) == 1:
+        return [(DEFAULT_SHARD, func(*args, **kwargs))]
+
+    def run(shard):
+        with app.app_context():
+            g.shard = shard
+            return func(*args, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        return list(zip(shards, pool.map(run, shards)))
+
+
+def for_each_shard(command):
+    """Run a CLI command body once against every shard"""
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        for shard in shard_keys():
+            if len(shard_keys()) > 1:
+                print(f"== Shard {shard}")
+            with use_shard(shard):
+                command(*args, **kwargs)
+    return wrapper
+
+
+def find_user_shard(username):
+    """Shard holding the account, found by asking every shard at once"""
+    found = fan_out(lambda: db.session.query(User.id).filter_by(username=username).first() is not None)
+    return next((shard for shard, exists in found if exists), DEFAULT_SHARD)
+
+
+@app.template_global()
+def shard_args(shard=None):
+    """URL arguments that pin an admin link to a shard, empty when not sharded"""
+    if len(shard_keys()) == 1:
+        return {}
+    return {'shard': shard or g.get('shard', DEFAULT_SHARD)}
+
+
+@app.before_request
+def select_shard():
+    """Faculty stay on their own shard, admins may point a request at any shard"""
+    g.shard = session.get('shard', DEFAULT_SHARD)
+    requested = request.args.get('shard')
+    if requested in shard_keys() and current_user.is_authenticated and current_user.username == 'admin':
+        switch_shard(requested)  # current_user stays loaded but detached
+
+
 def check_and_migrate_database():
     """Check if database needs migration and apply changes"""
     try:
@@ -107,6 +445,107 @@ def check_and_migrate_database():
             print(f"Migration failed: {migration_error}")
             db.session.rollback()
 
+    try:
+        db.session.execute(text("SELECT casual_leave_reserved FROM user LIMIT 1"))
+        print("Database already has leave reservation columns in user table")
+    except Exception as e:
+        print("Database needs migration for leave reservations...")
+        try:
+            for category in LEAVE_CATEGORIES:
+                db.session.execute(text(f"ALTER TABLE user ADD COLUMN {category}_leave_reserved FLOAT DEFAULT 0.0"))
+                # Existing pending requests already hold days
+                db.session.execute(text(f"""
+                    UPDATE user SET {category}_leave_reserved = (
+                        SELECT COALESCE(SUM((julianday(end_date) - julianday(start_date) + 1)
+                                            * CASE WHEN leave_type = 'half_day' THEN 0.5 ELSE 1.0 END), 0)
+                        FROM leave_request
+                        WHERE leave_request.user_id = user.id AND status = 'Pending'
+                          AND leave_category = :category)
+                """), {'category': category})
+            db.session.commit()
+            print("Successfully added leave reservation columns")
+        except Exception as migration_error:
+            print(f"Migration failed: {migration_error}")
+            db.session.rollback()
+
+    try:
+        db.session.execute(text("SELECT calendar_token FROM user LIMIT 1"))
+        print("Database already has calendar_token column in user table")
+    except Exception as e:
+        print("Database needs migration for calendar feeds...")
+        try:
+            db.session.execute(text("ALTER TABLE user ADD COLUMN calendar_token VARCHAR(32)"))
+            db.session.commit()
+            print("Successfully added calendar_token column to user table")
+        except Exception as migration_error:
+            print(f"Migration failed: {migration_error}")
+            db.session.rollback()
+
+    try:
+        db.session.execute(text("SELECT updated_at FROM leave_request LIMIT 1"))
+        print("Database already has updated_at column in leave_request table")
+    except Exception as e:
+        print("Database needs migration for leave_request change tracking...")
+        try:
+            db.session.execute(text("ALTER TABLE leave_request ADD COLUMN updated_at DATETIME"))
+            db.session.execute(text("UPDATE leave_request SET updated_at = COALESCE(approved_at, created_at)"))
+            db.session.commit()
+            print("Successfully added updated_at column to leave_request table")
+        except Exception as migration_error:
+            print(f"Migration failed: {migration_error}")
+            db.session.rollback()
+
+    # Indexes declared on the models are only created with new tables
+    for model in (User, LeaveRequest):
+        for index in model.__table__.indexes:
+            index.create(db.session.get_bind(), checkfirst=True)
+
+
+# Full-text indexes over leave reasons and admin remarks, kept in sync by triggers.
+# Archived requests get their own index, so archive-leaves does not drop them from search.
+SEARCH_TABLES = ('leave_request', 'archived_leave_request')
+
+
+def search_index_ddl(table):
+    return [
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5(
+            reason, admin_comments, content='{table}', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {table}_fts(rowid, reason, admin_comments)
+            VALUES (new.id, new.reason, new.admin_comments);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {table}_fts({table}_fts, rowid, reason, admin_comments)
+            VALUES ('delete', old.id, old.reason, old.admin_comments);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF reason, admin_comments ON {table} BEGIN
+            INSERT INTO {table}_fts({table}_fts, rowid, reason, admin_comments)
+            VALUES ('delete', old.id, old.reason, old.admin_comments);
+            INSERT INTO {table}_fts(rowid, reason, admin_comments)
+            VALUES (new.id, new.reason, new.admin_comments);
+        END""",
+    ]
+
+
+SEARCH_INDEX_DDL = [statement for table in SEARCH_TABLES for statement in search_index_ddl(table)]
+
+
+def create_search_index():
+    """Create the FTS5 indexes and their triggers, backfilling existing rows on first run"""
+    existing = {name for (name,) in db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    try:
+        for statement in SEARCH_INDEX_DDL:
+            db.session.execute(text(statement))
+        for table in SEARCH_TABLES:
+            if f'{table}_fts' not in existing:
+                db.session.execute(text(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')"))
+                print(f"Built full-text search index for {table}")
+        db.session.commit()
+    except Exception as e:
+        print(f"Full-text search index setup failed: {e}")
+        db.session.rollback()
+
 
 def create_admin_user():
     if User.query.filter_by(username='admin').first() is None:
@@ -182,8 +621,24 @@ def create_faculty_users():
         }
     ]
 
+    usernames = [faculty_data['username'] for faculty_data in faculty_list]
+    existing = {}
+    for shard, found in fan_out(lambda: [row.username for row in
+                                         db.session.query(User.username).filter(User.username.in_(usernames))]):
+        for username in found:
+            existing.setdefault(username, []).append(shard)
+
     for faculty_data in faculty_list:
-        if User.query.filter_by(username=faculty_data['username']).first() is None:
+        shard = shard_for_department(faculty_data['department'])
+        if faculty_data['username'] in existing:
+            if shard not in existing[faculty_data['username']]:
+                # A second copy would shadow the old one at login; see DEPARTMENT_SHARDS
+                app.logger.error("Not creating %s in shard %s: the account already exists in shard %s. "
+                                 "Move the department's users and leave rows there first.",
+                                 faculty_data['username'], shard, ', '.join(existing[faculty_data['username']]))
+            continue
+
+        with use_shard(shard):
             hashed_pw = generate_password_hash('password123')
             faculty = User(
                 username=faculty_data['username'],
@@ -202,9 +657,9 @@ def create_faculty_users():
                 earned_leave_used=0
             )
             db.session.add(faculty)
+            db.session.commit()
             print(f"Created faculty account: {faculty_data['full_name']}")
 
-    db.session.commit()
     print("All faculty accounts created successfully!")
 
 
@@ -221,318 +676,1428 @@ def validate_password_strength(password):
 
 # Create database tables and initialize data
 with app.app_context():
-    db.create_all()
-    check_and_migrate_database()
+    for shard in shard_keys():
+        with use_shard(shard):
+            db.metadata.create_all(db.session.get_bind())
+            check_and_migrate_database()
+            create_search_index()
     create_admin_user()
     create_faculty_users()
 
 
-def generate_enhanced_leave_letter(user, leave_request, past_leaves, total_medical, total_casual, total_earned):
-    """Generate a comprehensive leave letter with past records"""
+def leave_letter_context(leave_request):
+    """Collect the faculty's current-year leave records for the letter template"""
+    faculty = User.query.get(leave_request.user_id)
+
+    # Get past leave records for the current year
+    current_year = datetime.now().year
+    past_leaves = approved_leaves(faculty.id, year=current_year)
 
-    # Calculate current leave duration
     if leave_request.leave_type == 'half_day':
-        current_duration = ((leave_request.end_date - leave_request.start_date).days + 1) * 0.5
-        duration_text = f"{current_duration} days (Half Day)"
+        duration_text = f"{leave_request.duration} days (Half Day)"
+    else:
+        duration_text = f"{leave_request.duration} days"
+
+    return {
+        'user': faculty,
+        'leave_request': leave_request,
+        'past_leaves': past_leaves,
+        'duration_text': duration_text,
+        'current_date': datetime.now().strftime("%d/%m/%Y"),
+        'academic_year': current_year,
+        'total_medical': sum(leave.duration for leave in past_leaves if leave.leave_category == 'medical'),
+        'total_casual': sum(leave.duration for leave in past_leaves if leave.leave_category == 'casual'),
+        'total_earned': sum(leave.duration for leave in past_leaves if leave.leave_category == 'earned'),
+    }
+
+
+def letter_stylesheet():
+    with open(os.path.join(app.static_folder, 'letter.css'), encoding='utf-8') as f:
+        return f.read()
+
+
+def build_leave_letter(leave_request):
+    """Render the complete leave letter as a string, e.g. for the letter store
+
+    The stylesheet is inlined so a stored, saved or downloaded letter keeps its
+    styling without the site's assets.
+    """
+    return render_template('leave_letter.html', letter_css=letter_stylesheet(), **leave_letter_context(leave_request))
+
+
+# Letter Store
+LEGACY_LETTER_PATTERN = re.compile(r'^leave_(?:request|letter)_(\d+)_(\d{8}_\d{6})\.html$')
+
+
+def letter_blob_path(content_hash):
+    """Location of a gzip-compressed letter blob, fanned out by hash prefix"""
+    return os.path.join(app.config['LETTER_STORE_FOLDER'], content_hash[:2], f"{content_hash}.html.gz")
+
+
+def store_letter(request_id, letter_html, created_at=None):
+    """Save a letter under its content hash and index it against the request"""
+    data = letter_html.encode('utf-8')
+    content_hash = hashlib.sha256(data).hexdigest()
+    blob_path = letter_blob_path(content_hash)
+
+    if not os.path.exists(blob_path):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        os.replace(tmp_path, blob_path)
+
+    latest = latest_stored_letter(request_id)
+    if latest is not None and latest.content_hash == content_hash:
+        return latest
+
+    entry = LetterIndex(
+        request_id=request_id,
+        content_hash=content_hash,
+        original_size=len(data),
+        stored_size=os.path.getsize(blob_path),
+        created_at=created_at or datetime.utcnow()
+    )
+    db.session.add(entry)
+    return entry
+
+
+def latest_stored_letter(request_id):
+    return LetterIndex.query.filter_by(request_id=request_id).order_by(
+        LetterIndex.created_at.desc(), LetterIndex.id.desc()
+    ).first()
+
+
+def stored_letter_response(entry):
+    """Serve a stored letter, passing the gzip bytes through when the client accepts them"""
+    with open(letter_blob_path(entry.content_hash), 'rb') as f:
+        compressed = f.read()
+
+    # Strong ETags must differ per representation, as for the calendar feeds
+    etag = entry.content_hash
+    if 'gzip' in request.accept_encodings:
+        response = make_response(compressed)
+        response.headers['Content-Encoding'] = 'gzip'
+        etag += '-gz'
+    else:
+        response = make_response(gzip.decompress(compressed))
+    response.headers['Content-Type'] = 'text/html; charset=utf-8'
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def leave_duration_expression(source=LeaveRequest):
+    """SQL equivalent of LeaveRequest.duration, an integer for full days as in Python"""
+    days = db.cast(db.func.julianday(source.end_date) - db.func.julianday(source.start_date), db.Integer) + 1
+    return db.case((source.leave_type == 'half_day', days * 0.5), else_=days)
+
+
+# Leave Archive
+ARCHIVED_COLUMNS = [column.name for column in LeaveRequest.__table__.columns]
+
+
+def leave_records(where=None):
+    """Hot and archived leave requests as one selectable, for reads that span all years
+
+    where(model), if given, returns criteria applied to each branch before the
+    union, where the per-table indexes can still serve them.
+    """
+    def branch(model):
+        query = db.select(*(model.__table__.c[name] for name in ARCHIVED_COLUMNS))
+        return query.where(*where(model)) if where is not None else query
+
+    return db.union_all(branch(LeaveRequest), branch(ArchivedLeaveRequest)).subquery('leave_records')
+
+
+def archived_through():
+    """Latest end date in the archive, or None; anything later is only in leave_request"""
+    return db.session.query(db.func.max(ArchivedLeaveRequest.end_date)).scalar()
+
+
+def approved_leaves(user_id, start_from=None, end_to=None, year=None):
+    """Approved leave of one faculty member, newest first, as light rows with the duration from SQL
+
+    The archive is only read when the requested range reaches back into it, so
+    current-year lookups stay on the small leave_request table.
+    """
+    def approved(model):
+        query = db.session.query(
+            model.id, model.start_date, model.end_date, model.leave_category, model.leave_type,
+            model.reason, model.approved_at, leave_duration_expression(model).label('duration')
+        ).filter(model.user_id == user_id, model.status == 'Approved')
+        if start_from:
+            query = query.filter(model.start_date >= start_from)
+        if end_to:
+            query = query.filter(model.end_date <= end_to)
+        if year:
+            query = query.filter(db.extract('year', model.start_date) == year)
+        return query.order_by(model.start_date.desc()).all()
+
+    leaves = approved(LeaveRequest)
+    earliest = start_from or (date(year, 1, 1) if year else None)
+    boundary = archived_through()
+    if boundary is not None and (earliest is None or earliest <= boundary):
+        leaves = sorted(leaves + approved(ArchivedLeaveRequest), key=lambda leave: leave.start_date, reverse=True)
+    return leaves
+
+
+# Leave Balances
+def leave_column(category, field):
+    return getattr(User, f'{category}_leave_{field}')
+
+
+def reserve_leave(user_id, category, days):
+    """Hold days for a new pending request; False if the balance cannot cover it
+
+    A single conditional UPDATE, so concurrent submissions cannot both pass the check.
+    """
+    left, reserved = leave_column(category, 'left'), leave_column(category, 'reserved')
+    return User.query.filter(
+        User.id == user_id,
+        left - db.func.coalesce(reserved, 0) >= days
+    ).update({reserved: db.func.coalesce(reserved, 0) + days}, synchronize_session=False) == 1
+
+
+def release_leave(user_id, category, days, consume=False):
+    """Drop a reservation, charging the days to the balance when the leave was approved"""
+    reserved = leave_column(category, 'reserved')
+    values = {reserved: db.func.max(db.func.coalesce(reserved, 0) - days, 0)}
+    if consume:
+        used, left = leave_column(category, 'used'), leave_column(category, 'left')
+        values.update({used: used + days, left: left - days})
+    User.query.filter(User.id == user_id).update(values, synchronize_session=False)
+
+
+def close_leave_request(leave_request, status, **values):
+    """Move a pending request to its final status and settle its reservation, exactly once"""
+    changed = LeaveRequest.query.filter_by(id=leave_request.id, status='Pending').update(
+        dict(values, status=status), synchronize_session='evaluate'
+    )
+    if not changed:
+        return False
+    if leave_request.leave_category in LEAVE_CATEGORIES:
+        release_leave(leave_request.user_id, leave_request.leave_category, leave_request.duration,
+                      consume=(status == 'Approved'))
+    return True
+
+
+def rebuild_reservations(apply_fixes=True):
+    """Recompute reserved days from pending requests in one grouped query
+
+    Returns the users whose counters were wrong as [{'id': ..., column: expected}].
+    """
+    duration = leave_duration_expression()
+    pending_days = [
+        db.func.coalesce(db.func.sum(
+            db.case((LeaveRequest.leave_category == category, duration), else_=0)
+        ), 0) for category in LEAVE_CATEGORIES
+    ]
+    stored = [leave_column(category, 'reserved') for category in LEAVE_CATEGORIES]
+    rows = db.session.query(User.id, *stored, *pending_days).outerjoin(
+        LeaveRequest, db.and_(LeaveRequest.user_id == User.id, LeaveRequest.status == 'Pending')
+    ).group_by(User.id)
+
+    corrections = []
+    for user_id, *values in rows:
+        current, expected = values[:len(LEAVE_CATEGORIES)], values[len(LEAVE_CATEGORIES):]
+        fix = {f'{category}_leave_reserved': float(want)
+               for category, have, want in zip(LEAVE_CATEGORIES, current, expected)
+               if abs((have or 0) - want) > 1e-9}
+        if fix:
+            corrections.append(dict(fix, id=user_id))
+
+    if apply_fixes and corrections:
+        by_columns = {}
+        for fix in corrections:
+            by_columns.setdefault(tuple(sorted(fix)), []).append(fix)
+        for batch in by_columns.values():
+            db.session.execute(db.update(User), batch)
+        db.session.commit()
+    return corrections
+
+
+# Leave Analytics
+ANALYTICS_DIMENSIONS = ('department', 'leave_category', 'leave_type', 'year', 'month', 'status')
+
+
+def rollup_cell_columns(source=LeaveRequest):
+    """The cube key of a leave request, status excluded; a refresh rebuilds whole cells"""
+    return (User.department, source.leave_category, source.leave_type,
+            db.extract('year', source.start_date), db.extract('month', source.start_date))
+
+
+def rollup_cell_criteria(cells):
+    """Index-friendly criteria for the rows of the given cells, per leave_records() branch
+
+    The cube key is built from extract() and the user's department, which no
+    index serves, so rows are first narrowed to the departments' users and the
+    start_date span of the changed months (the (user_id, start_date) indexes).
+    """
+    months = sorted({(int(cell[3]), int(cell[4])) for cell in cells})
+    bounds = [(date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)) for year, month in months]
+    users = db.select(User.id).where(User.department.in_({cell[0] for cell in cells}))
+
+    def criteria(model):
+        return [model.user_id.in_(users),
+                model.start_date >= bounds[0][0], model.start_date < bounds[-1][1],
+                db.or_(*(db.and_(model.start_date >= low, model.start_date < high) for low, high in bounds))]
+    return criteria
+
+
+def refresh_leave_rollup(full=False):
+    """Bring LeaveRollup up to date with leave_request for the current shard
+
+    Only the cells touched by rows whose updated_at is past the watermark are
+    recomputed, reading just the rows of those departments and months, so a
+    refresh costs the size of the change, not of the table. Cells are summed
+    over hot and archived rows, so archiving changes nothing. Leaves are counted
+    in the month they start. Returns the number of cells rebuilt.
+    """
+    started = datetime.utcnow()
+    watermark = db.session.get(RollupWatermark, 'leave_rollup')
+    cell = rollup_cell_columns()
+
+    rows = db.session.query(*cell).join(User, User.id == LeaveRequest.user_id)
+    if full or watermark is None:
+        LeaveRollup.query.delete(synchronize_session=False)
+        changed = None
     else:
-        current_duration = (leave_request.end_date - leave_request.start_date).days + 1
-        duration_text = f"{current_duration} days"
+        since = watermark.refreshed_through - timedelta(seconds=app.config['ANALYTICS_WATERMARK_OVERLAP_SECONDS'])
+        changed = rows.filter(db.or_(LeaveRequest.updated_at >= since,
+                                     LeaveRequest.updated_at.is_(None))).distinct().all()
+        if changed:
+            rollup_cell = db.tuple_(LeaveRollup.department, LeaveRollup.leave_category, LeaveRollup.leave_type,
+                                    LeaveRollup.year, LeaveRollup.month)
+            LeaveRollup.query.filter(rollup_cell.in_(changed)).delete(synchronize_session=False)
+
+    cells = 0
+    if changed is None or changed:
+        records = leave_records(rollup_cell_criteria(changed) if changed else None).c
+        cell = rollup_cell_columns(records)
+        approved_turnaround = db.case(
+            (records.approved_at.isnot(None),
+             (db.func.julianday(records.approved_at) - db.func.julianday(records.created_at)) * 86400),
+        )
+        totals = db.session.query(
+            *cell, records.status, db.func.count(records.id),
+            db.func.sum(leave_duration_expression(records)),
+            db.func.coalesce(db.func.sum(approved_turnaround), 0), db.func.count(approved_turnaround)
+        ).join(User, User.id == records.user_id).group_by(*cell, records.status)
+        if changed:
+            totals = totals.filter(db.tuple_(*cell).in_(changed))
+
+        measures = ('request_count', 'total_days', 'turnaround_seconds', 'turnaround_count')
+        values = [dict(zip(ANALYTICS_DIMENSIONS + measures, row)) for row in totals]
+        if values:
+            db.session.execute(db.insert(LeaveRollup), values)
+        cells = len(changed) if changed is not None else len({
+            tuple(value[name] for name in ANALYTICS_DIMENSIONS[:5]) for value in values
+        })
+
+    if watermark is None:
+        watermark = RollupWatermark(name='leave_rollup', refreshed_through=started)
+        db.session.add(watermark)
+    watermark.refreshed_through = started
+    db.session.commit()
+    return cells
+
+
+def leave_rollup_report(group_by, filters):
+    """Sum the cube over the dimensions not in group_by, for the current shard"""
+    dimensions = [getattr(LeaveRollup, name) for name in group_by]
+    query = db.session.query(
+        *dimensions,
+        db.func.sum(LeaveRollup.request_count), db.func.sum(LeaveRollup.total_days),
+        db.func.sum(db.case((LeaveRollup.leave_type == 'half_day', LeaveRollup.request_count), else_=0)),
+        db.func.sum(LeaveRollup.turnaround_seconds), db.func.sum(LeaveRollup.turnaround_count)
+    )
+    for name, value in filters.items():
+        query = query.filter(getattr(LeaveRollup, name) == value)
+    return [(tuple(row[:len(group_by)]), row[len(group_by):]) for row in query.group_by(*dimensions)]
+
+
+def analytics_rows(group_by, filters):
+    """Query the cube on every shard and merge the partial sums per group"""
+    merged = {}
+    for _, partial in fan_out(leave_rollup_report, group_by, filters):
+        for key, sums in partial:
+            merged[key] = [total + (value or 0) for total, value in zip(merged.get(key, [0] * 5), sums)]
+
+    rows = []
+    for key in sorted(merged, key=lambda key: tuple('' if part is None else part for part in key)):
+        count, days, half_days, turnaround, turnaround_count = merged[key]
+        rows.append(dict(zip(group_by, key),
+                         requests=count,
+                         days=days,
+                         half_day_ratio=round(half_days / count, 3) if count else 0,
+                         avg_turnaround_hours=round(turnaround / turnaround_count / 3600, 1) if turnaround_count else None))
+    return rows
+
+
+def analytics_refreshed_through():
+    """Time the cube is complete up to on every shard, None until each has been built"""
+    def watermark():
+        return db.session.query(RollupWatermark.refreshed_through).filter_by(name='leave_rollup').scalar()
+
+    marks = [mark for _, mark in fan_out(watermark)]
+    return None if None in marks else min(marks)
+
+
+def analytics_filters(args):
+    filters = {}
+    for name in ('department', 'leave_category', 'leave_type', 'status'):
+        if args.get(name):
+            filters[name] = args[name]
+    for name in ('year', 'month'):
+        if args.get(name, '').isdigit():
+            filters[name] = int(args[name])
+    return filters
+
+
+# Admin Queue
+PENDING_FACETS = {
+    'department': User.department,
+    'leave_category': LeaveRequest.leave_category,
+    'leave_type': LeaveRequest.leave_type,
+}
+
+
+# Only what the queue renders; a full LeaveRequest + User pair also drags in
+# password hashes and every balance column
+PENDING_ROW_COLUMNS = (
+    LeaveRequest.id, LeaveRequest.created_at, LeaveRequest.start_date, LeaveRequest.end_date,
+    LeaveRequest.leave_category, LeaveRequest.leave_type, LeaveRequest.reason,
+    User.full_name.label('faculty_name'), User.email.label('faculty_email'), User.department,
+)
+
+
+def pending_queue(selected, start_from=None, start_to=None, min_days=None, max_days=None, page=1, per_page=50):
+    """Filter the pending queue and count every facet value in a single grouped query
+
+    Each facet's counts ignore that facet's own selection, so the admin can see
+    what switching department or category would return.
+    """
+    base_filters = [LeaveRequest.status == 'Pending']
+    if start_from:
+        base_filters.append(LeaveRequest.start_date >= start_from)
+    if start_to:
+        base_filters.append(LeaveRequest.start_date <= start_to)
+    if min_days is not None:
+        base_filters.append(leave_duration_expression() >= min_days)
+    if max_days is not None:
+        base_filters.append(leave_duration_expression() <= max_days)
+
+    columns = list(PENDING_FACETS.values())
+    grouped = db.session.query(*columns, db.func.count()).join(
+        User, LeaveRequest.user_id == User.id
+    ).filter(*base_filters).group_by(*columns).all()
+
+    def matches(combo, skip=None):
+        return all(selected.get(name) in (None, combo[name]) for name in PENDING_FACETS if name != skip)
+
+    facets = {name: {} for name in PENDING_FACETS}
+    total = 0
+    for *values, count in grouped:
+        combo = dict(zip(PENDING_FACETS, values))
+        for name in PENDING_FACETS:
+            if matches(combo, skip=name):
+                facets[name][combo[name]] = facets[name].get(combo[name], 0) + count
+        if matches(combo):
+            total += count
+
+    facet_filters = [column == selected[name] for name, column in PENDING_FACETS.items() if selected.get(name)]
+    rows = db.session.query(
+        *PENDING_ROW_COLUMNS,
+        leave_duration_expression().label('duration'),
+        db.literal(g.get('shard', DEFAULT_SHARD)).label('shard')
+    ).select_from(LeaveRequest).join(
+        User, LeaveRequest.user_id == User.id
+    ).filter(*base_filters, *facet_filters).order_by(
+        LeaveRequest.created_at.desc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    facets = {name: sorted(counts.items(), key=lambda item: str(item[0])) for name, counts in facets.items()}
+    return rows, facets, total
+
+
+def merged_pending_queue(selected, page=1, per_page=50, **filters):
+    """pending_queue() over every shard, returns (rows, facets, total)"""
+    if len(shard_keys()) == 1:
+        shard_page, shard_per_page, offset = page, per_page, 0
+    else:  # every shard supplies enough rows to fill this page once merged
+        shard_page, shard_per_page, offset = 1, page * per_page, (page - 1) * per_page
+
+    pending_requests, facet_counts, total = [], {name: {} for name in PENDING_FACETS}, 0
+    for shard, (rows, facets, shard_total) in fan_out(
+            pending_queue, selected, page=shard_page, per_page=shard_per_page, **filters):
+        pending_requests.extend(rows)
+        for name, counts in facets.items():
+            for value, count in counts:
+                facet_counts[name][value] = facet_counts[name].get(value, 0) + count
+        total += shard_total
+
+    pending_requests.sort(key=lambda row: row.created_at, reverse=True)
+    pending_requests = pending_requests[offset:offset + per_page]
+    facets = {name: sorted(counts.items(), key=lambda item: str(item[0])) for name, counts in facet_counts.items()}
+    return pending_requests, facets, total
+
+
+def admin_dashboard_counts():
+    """(pending requests, faculty, approved this month) summed over every shard"""
+    def shard_counts():
+        return (
+            LeaveRequest.query.filter_by(status='Pending').count(),
+            User.query.filter(User.username != 'admin').count(),
+            LeaveRequest.query.filter(
+                LeaveRequest.status == 'Approved',
+                db.extract('month', LeaveRequest.approved_at) == datetime.now().month,
+                db.extract('year', LeaveRequest.approved_at) == datetime.now().year
+            ).count()
+        )
 
-    current_date = datetime.now().strftime("%d/%m/%Y")
+    counts = [counts for _, counts in fan_out(shard_counts)]
+    return tuple(sum(column) for column in zip(*counts))
 
-    # Generate past leaves table
-    past_leaves_table = ""
-    for i, past_leave in enumerate(past_leaves[:10]):  # Last 10 leaves
-        if past_leave.leave_type == 'half_day':
-            past_duration = ((past_leave.end_date - past_leave.start_date).days + 1) * 0.5
+
+# Search
+def build_match_query(search_text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r'\w+', search_text)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_leave_requests(search_text, status=None, category=None, department=None, page=1, per_page=25):
+    """Ranked full-text search over hot and archived leave requests
+
+    Returns ((LeaveRequest or ArchivedLeaveRequest, User, rank) rows, total).
+    """
+    match_query = build_match_query(search_text)
+    if not match_query:
+        return [], 0
+
+    params = {'match': match_query, 'status': status, 'category': category, 'department': department}
+
+    def matches(table):
+        filters = [f"{table}_fts MATCH :match"]
+        if status:
+            filters.append(f"{table}.status = :status")
+        if category:
+            filters.append(f"{table}.leave_category = :category")
+        if department:
+            filters.append("user.department = :department")
+        return f"""
+            SELECT {table}.id, {table}.created_at, bm25({table}_fts) AS rank, '{table}' AS source
+            FROM {table}_fts
+            JOIN {table} ON {table}.id = {table}_fts.rowid
+            JOIN user ON user.id = {table}.user_id
+            WHERE """ + ' AND '.join(filters)
+
+    # bm25 ranks are per index, which is close enough to interleave the two tables
+    matched = ' UNION ALL '.join(matches(table) for table in SEARCH_TABLES)
+    total = db.session.execute(text(f"SELECT COUNT(*) FROM ({matched})"), params).scalar()
+    ranked = db.session.execute(text(
+        f"SELECT id, rank, source FROM ({matched}) ORDER BY rank, created_at DESC LIMIT :limit OFFSET :offset"
+    ), dict(params, limit=per_page, offset=(page - 1) * per_page)).all()
+
+    if not ranked:
+        return [], total
+
+    by_key = {}
+    for model in (LeaveRequest, ArchivedLeaveRequest):
+        ids = [row.id for row in ranked if row.source == model.__tablename__]
+        if ids:
+            rows = db.session.query(model, User).join(User, model.user_id == User.id).filter(model.id.in_(ids))
+            by_key.update(((model.__tablename__, leave.id), (leave, faculty)) for leave, faculty in rows)
+    return [by_key[row.source, row.id] + (row.rank,) for row in ranked if (row.source, row.id) in by_key], total
+
+
+# Background Jobs
+JOB_HANDLERS = {}
+
+
+def job_handler(kind):
+    """Register a function as the handler for a job kind"""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue_job(kind, **payload):
+    """Add a job to the session; it becomes visible to workers when the caller commits"""
+    job = Job(kind=kind, payload=json.dumps(payload), max_attempts=app.config['JOB_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+def claim_job(worker_id):
+    """Lease the oldest runnable job to this worker, or return None"""
+    now = datetime.utcnow()
+    runnable = db.or_(
+        db.and_(Job.status == 'queued', Job.run_after <= now),
+        db.and_(Job.status == 'running', Job.lease_until < now)  # lease expired, worker died
+    )
+    while True:
+        candidate = db.session.query(Job.id).filter(runnable).order_by(Job.run_after, Job.id).first()
+        if candidate is None:
+            return None
+
+        # Only one worker can win the conditional update for a given row
+        claimed = Job.query.filter(Job.id == candidate.id, runnable).update({
+            'status': 'running',
+            'locked_by': worker_id,
+            'lease_until': now + timedelta(seconds=app.config['JOB_LEASE_SECONDS']),
+            'attempts': Job.attempts + 1,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return Job.query.get(candidate.id)
+
+
+def run_job(job):
+    """Execute a claimed job and record success, retry or failure"""
+    handler = JOB_HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(**json.loads(job.payload))
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+    except Exception:
+        db.session.rollback()
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
         else:
-            past_duration = (past_leave.end_date - past_leave.start_date).days + 1
-
-        past_leaves_table += f"""
-        <tr>
-            <td>{i + 1}</td>
-            <td>{past_leave.start_date.strftime('%d/%m/%Y')}</td>
-            <td>{past_leave.end_date.strftime('%d/%m/%Y')}</td>
-            <td>{past_duration}</td>
-            <td>{past_leave.leave_category.title()}</td>
-            <td>{past_leave.leave_type.replace('_', ' ').title()}</td>
-            <td>{past_leave.reason[:50]}{'...' if len(past_leave.reason) > 50 else ''}</td>
-        </tr>
-        """
-
-    # If no past leaves
-    if not past_leaves_table:
-        past_leaves_table = """
-        <tr>
-            <td colspan="7" class="text-center">No previous leave records found for this academic year</td>
-        </tr>
-        """
-
-    letter_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Leave Application - {user.full_name}</title>
-        <style>
-            body {{
-                font-family: 'Arial', sans-serif;
-                margin: 40px;
-                line-height: 1.6;
-                color: #000;
-                background: #fff;
-            }}
-            .letter-container {{
-                max-width: 1000px;
-                margin: 0 auto;
-                padding: 20px;
-                border: 1px solid #ddd;
-                background: white;
-            }}
-            .header {{
-                text-align: center;
-                margin-bottom: 30px;
-                border-bottom: 2px solid #000;
-                padding-bottom: 20px;
-            }}
-            .college-name {{
-                font-size: 22px;
-                font-weight: bold;
-                margin-bottom: 5px;
-                color: #2c3e50;
-            }}
-            .address {{
-                font-size: 12px;
-                margin-bottom: 10px;
-                color: #7f8c8d;
-            }}
-            .content {{
-                margin: 30px 0;
-            }}
-            .subject {{
-                font-weight: bold;
-                margin: 20px 0;
-                text-decoration: underline;
-                font-size: 16px;
-            }}
-            .footer {{
-                margin-top: 50px;
-            }}
-            .signature {{
-                margin-top: 80px;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 15px 0;
-                font-size: 12px;
-            }}
-            th, td {{
-                padding: 8px;
-                border: 1px solid #000;
-                text-align: left;
-            }}
-            th {{
-                background-color: #f2f2f2;
-                font-weight: bold;
-            }}
-            .section-title {{
-                background: #2c3e50;
-                color: white;
-                padding: 10px;
-                margin: 20px 0 10px 0;
-                font-weight: bold;
-            }}
-            .stats-grid {{
-                display: grid;
-                grid-template-columns: repeat(3, 1fr);
-                gap: 10px;
-                margin: 15px 0;
-            }}
-            .stat-card {{
-                border: 1px solid #ddd;
-                padding: 10px;
-                text-align: center;
-                background: #f8f9fa;
-            }}
-            .stat-number {{
-                font-size: 18px;
-                font-weight: bold;
-                color: #2c3e50;
-            }}
-            .print-btn {{
-                position: fixed;
-                top: 20px;
-                right: 20px;
-                padding: 10px 20px;
-                background: #2c3e50;
-                color: white;
-                border: none;
-                border-radius: 5px;
-                cursor: pointer;
-                z-index: 1000;
-            }}
-            @media print {{
-                body {{ margin: 0; }}
-                .letter-container {{ border: none; padding: 0; }}
-                .print-btn {{ display: none; }}
-            }}
-        </style>
-    </head>
-    <body>
-        <button class="print-btn" onclick="window.print()">🖨️ Print Letter</button>
-
-        <div class="letter-container">
-            <!-- College Header -->
-            <div class="header">
-                <div class="college-name">Pillai College of Engineering (Autonomous)</div>
-                <div class="address">
-                    Dr. K. M. Vasudevan Pillai Campus<br>
-                    Plot No. 10, Sector 16, New Panvel,<br>
-                    Navi Mumbai, Mumbai – 410 206<br>
-                    Email: pce@mes.ac.in | Website: www.pce.ac.in
-                </div>
-            </div>
-
-            <div class="content">
-                <!-- Date and To Section -->
-                <p><strong>Date:</strong> {current_date}</p>
-                <p><strong>To,</strong><br>
-                The Head of Department<br>
-                {user.department} Department<br>
-                Pillai College of Engineering (Autonomous)<br>
-                New Panvel, Navi Mumbai</p>
-
-                <!-- Subject -->
-                <p class="subject">Subject: Application for {leave_request.leave_category.title()} Leave</p>
-
-                <!-- Salutation -->
-                <p><strong>Respected Sir/Madam,</strong></p>
-
-                <!-- Main Content -->
-                <p>I, <strong>{user.full_name}</strong>, Faculty in the <strong>{user.department}</strong> Department, 
-                hereby request your kind permission to grant me {leave_request.leave_category} leave for 
-                <strong>{duration_text}</strong> from <strong>{leave_request.start_date.strftime('%d/%m/%Y')}</strong> to 
-                <strong>{leave_request.end_date.strftime('%d/%m/%Y')}</strong>.</p>
-
-                <!-- Current Leave Details -->
-                <div class="section-title">CURRENT LEAVE APPLICATION DETAILS</div>
-                <table>
-                    <tr>
-                        <td><strong>Faculty Name</strong></td>
-                        <td>{user.full_name}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Department</strong></td>
-                        <td>{user.department}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Employee ID</strong></td>
-                        <td>{user.username}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Leave Category</strong></td>
-                        <td>{leave_request.leave_category.title()} Leave</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Leave Type</strong></td>
-                        <td>{leave_request.leave_type.replace('_', ' ').title()}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Duration</strong></td>
-                        <td>{leave_request.start_date.strftime('%d/%m/%Y')} to {leave_request.end_date.strftime('%d/%m/%Y')} ({duration_text})</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Reason</strong></td>
-                        <td>{leave_request.reason}</td>
-                    </tr>
-                </table>
-
-                <!-- Leave Statistics -->
-                <div class="section-title">LEAVE UTILIZATION SUMMARY (ACADEMIC YEAR {datetime.now().year})</div>
-                <div class="stats-grid">
-                    <div class="stat-card">
-                        <div class="stat-number">{total_medical}</div>
-                        <div>Medical Leaves Taken</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{total_casual}</div>
-                        <div>Casual Leaves Taken</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{total_earned}</div>
-                        <div>Earned Leaves Taken</div>
-                    </div>
-                </div>
-
-                <!-- Past Leave History -->
-                <div class="section-title">PREVIOUS LEAVE HISTORY (LAST 10 RECORDS)</div>
-                <table>
-                    <thead>
-                        <tr>
-                            <th>#</th>
-                            <th>Start Date</th>
-                            <th>End Date</th>
-                            <th>Days</th>
-                            <th>Category</th>
-                            <th>Type</th>
-                            <th>Reason</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {past_leaves_table}
-                    </tbody>
-                </table>
-
-                <!-- Assurance and Closing -->
-                <p>I assure you that I have made necessary arrangements for my academic responsibilities 
-                to continue smoothly during my absence. All pending work and classes will be managed 
-                as per the department's guidelines.</p>
-
-                <p>Kindly grant me the leave for the mentioned period.</p>
-
-                <div class="signature">
-                    <p>Thanking you,</p>
-                    <br><br>
-                    <p><strong>{user.full_name}</strong><br>
-                    Faculty, {user.department}<br>
-                    Pillai College of Engineering</p>
-                </div>
-            </div>
-
-            <!-- Office Use Section -->
-            <div class="footer">
-                <hr>
-                <div class="section-title">FOR OFFICE USE ONLY</div>
-                <table>
-                    <tr>
-                        <td width="30%"><strong>Leave Approved:</strong></td>
-                        <td>
-                            □ Yes □ No<br>
-                            <strong>Status:</strong> {leave_request.status}<br>
-                            {f"<strong>Approved On:</strong> {leave_request.approved_at.strftime('%d/%m/%Y')}" if leave_request.approved_at else ""}
-                        </td>
-                    </tr>
-                    <tr>
-                        <td><strong>Remarks:</strong></td>
-                        <td>{leave_request.admin_comments if leave_request.admin_comments else "_________________________________"}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Authorized Signature:</strong></td>
-                        <td>_________________________________</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Date:</strong></td>
-                        <td>_________________________________</td>
-                    </tr>
-                </table>
-            </div>
-        </div>
-    </body>
-    </html>
+            # Exponential backoff between attempts
+            delay = app.config['JOB_RETRY_BASE_SECONDS'] * (2 ** (job.attempts - 1))
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=delay)
+    job.lease_until = None
+    job.locked_by = None
+    db.session.commit()
+    return job.status
+
+
+def send_email(to, subject, body):
+    """Deliver a plain-text email through the configured SMTP host"""
+    message = EmailMessage()
+    message['From'] = app.config['MAIL_DEFAULT_SENDER']
+    message['To'] = to
+    message['Subject'] = subject
+    message.set_content(body)
+    with smtplib.SMTP(app.config['MAIL_SERVER'], app.config['MAIL_PORT'], timeout=30) as smtp:
+        smtp.send_message(message)
+
+
+@job_handler('send_email')
+def send_email_job(to, subject, body):
+    send_email(to, subject, body)
+
+
+@job_handler('render_letter')
+def render_letter_job(request_id):
+    """Pre-render the leave letter so it is ready when the faculty opens it"""
+    leave_request = LeaveRequest.query.get(request_id)
+    if leave_request is None:
+        return
+
+    # Asset URLs in the letter need a request context to build
+    with app.test_request_context():
+        letter_html = build_leave_letter(leave_request)
+    entry = store_letter(leave_request.id, letter_html)
+    leave_request.letter_path = os.path.relpath(letter_blob_path(entry.content_hash), app.root_path)
+    db.session.commit()
+
+
+def enqueue_decision_jobs(leave_request, faculty):
+    """Queue the follow-up work for an approved or rejected leave request"""
+    if leave_request.status == 'Approved':
+        enqueue_job('render_letter', request_id=leave_request.id)
+
+    body = (f"Dear {faculty.full_name},\n\n"
+            f"Your {leave_request.leave_category} leave request from "
+            f"{leave_request.start_date.strftime('%d/%m/%Y')} to {leave_request.end_date.strftime('%d/%m/%Y')} "
+            f"has been {leave_request.status.lower()}.\n")
+    if leave_request.admin_comments:
+        body += f"\nRemarks: {leave_request.admin_comments}\n"
+    body += "\nPCE Faculty Portal"
+    enqueue_job('send_email',
+                to=faculty.email,
+                subject=f"Leave request {leave_request.status.lower()}",
+                body=body)
+
+
+# Live Updates
+LIVE_COUNTER_DELTAS = {
+    'created': {'pending': 1},
+    'approved': {'pending': -1, 'approved_this_month': 1},
+    'rejected': {'pending': -1},
+    'withdrawn': {'pending': -1},
+}
+
+
+class LiveSubscriber:
+    """The queue of one SSE stream; lagged is set when the bus had to drop it"""
+
+    def __init__(self):
+        self.events = queue.Queue(maxsize=app.config['LIVE_QUEUE_SIZE'])
+        self.lagged = False
+
+
+class EventBus:
+    """Fan-out of queue events to the SSE streams of this worker
+
+    Write routes publish their own events right after committing; a relay thread,
+    started with the first stream, publishes the events other workers logged in
+    the queue_event tables and keeps the admin counters seeded.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.origin = f"{socket.gethostname()}:{self.pid}"
+        self.token = os.urandom(4).hex()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.recent = deque(maxlen=app.config['LIVE_REPLAY_SIZE'])
+        self.subscribers = set()
+        self.counters = None
+        self.relay_thread = None
+
+    def publish(self, event, counters=None):
+        with self.lock:
+            if counters is not None:
+                self.counters = dict(counters)
+            elif self.counters is not None:
+                for name, delta in event.get('deltas', {}).items():
+                    self.counters[name] += delta
+            self.seq += 1
+            event = dict(event, id=f'{self.token}-{self.seq}')
+            if self.counters is not None:
+                event['counters'] = dict(self.counters)
+            self.recent.append((self.seq, event))
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.events.put_nowait(event)
+                except queue.Full:  # a stalled client resyncs rather than holding events
+                    subscriber.lagged = True
+                    self.subscribers.discard(subscriber)
+
+    def subscribe(self, last_event_id=None):
+        """Register a stream; returns (subscriber, missed events or None when they are gone)"""
+        subscriber = LiveSubscriber()
+        with self.lock:
+            if self.relay_thread is None:
+                self.relay_thread = threading.Thread(target=self.relay, name='live-relay', daemon=True)
+                self.relay_thread.start()
+            self.subscribers.add(subscriber)
+
+            missed = []
+            if last_event_id:
+                token, _, seq = last_event_id.partition('-')
+                oldest = self.recent[0][0] if self.recent else self.seq + 1
+                if token != self.token or not seq.isdigit() or int(seq) < oldest - 1:
+                    missed = None
+                else:
+                    missed = [event for number, event in self.recent if number > int(seq)]
+        return subscriber, missed
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def seed_counters(self):
+        pending, _, approved_this_month = admin_dashboard_counts()
+        self.publish({'kind': 'counters'},
+                     counters={'pending': pending, 'approved_this_month': approved_this_month})
+
+    def relay(self):
+        """Publish events logged by other workers, one indexed range read per shard and poll"""
+        with app.app_context():
+            cursors = dict(fan_out(lambda: db.session.query(db.func.max(QueueEvent.id)).scalar() or 0))
+            seeded_at = 0
+            while True:
+                try:
+                    if time.monotonic() - seeded_at >= app.config['LIVE_COUNTER_RESEED_SECONDS']:
+                        self.seed_counters()
+                        prune_queue_events()
+                        seeded_at = time.monotonic()
+
+                    for shard in shard_keys():
+                        with use_shard(shard):
+                            rows = db.session.query(QueueEvent.id, QueueEvent.origin, QueueEvent.payload).filter(
+                                QueueEvent.id > cursors.get(shard, 0)
+                            ).order_by(QueueEvent.id).all()
+                        for row in rows:
+                            if row.origin != self.origin:
+                                self.publish(json.loads(row.payload))
+                            cursors[shard] = row.id
+                except Exception:
+                    app.logger.exception('Live event relay failed')
+                db.session.remove()
+                time.sleep(app.config['LIVE_POLL_INTERVAL'])
+
+
+_live_bus = None
+_live_bus_lock = threading.Lock()
+
+
+def live_bus():
+    """This process's event bus; a forked worker gets its own"""
+    global _live_bus
+    with _live_bus_lock:
+        if _live_bus is None or _live_bus.pid != os.getpid():
+            _live_bus = EventBus()
+        return _live_bus
+
+
+def record_queue_event(kind, leave_request, faculty):
+    """Log a queue change in the caller's transaction; publish the returned event after commit"""
+    # Also flushes, so a new request has its id
+    left = db.session.query(leave_column(leave_request.leave_category, 'left')).filter(
+        User.id == faculty.id).scalar() if leave_request.leave_category in LEAVE_CATEGORIES else None
+    event = {
+        'kind': kind,
+        'shard': g.get('shard', DEFAULT_SHARD),
+        'request_id': leave_request.id,
+        'user_id': faculty.id,
+        'faculty_name': faculty.full_name,
+        'department': faculty.department,
+        'leave_category': leave_request.leave_category,
+        'leave_type': leave_request.leave_type,
+        'start_date': leave_request.start_date.isoformat(),
+        'end_date': leave_request.end_date.isoformat(),
+        'duration': leave_request.duration,
+        'status': leave_request.status,
+        'left': left,
+        'deltas': LIVE_COUNTER_DELTAS[kind],
+    }
+    db.session.add(QueueEvent(origin=live_bus().origin, payload=json.dumps(event)))
+    return event
+
+
+def prune_queue_events():
+    """Drop change-log rows every worker has long since relayed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['LIVE_EVENT_RETENTION_SECONDS'])
+    for shard in shard_keys():
+        with use_shard(shard):
+            QueueEvent.query.filter(QueueEvent.created_at < cutoff).delete(synchronize_session=False)
+            db.session.commit()
+
+
+def live_message(event, audience=None):
+    """Format an event for one SSE stream; faculty only see their own requests"""
+    if audience is not None:
+        if (event.get('shard'), event.get('user_id')) != audience:
+            return None
+        event = {key: value for key, value in event.items() if key not in ('counters', 'deltas')}
+    lines = [f"id: {event['id']}"] if 'id' in event else []
+    lines += [f"event: {event['kind']}", f"data: {json.dumps(event)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+# Calendar Feeds
+_calendar_feeds = {}   # (shard, feed, key) -> (version, ics bytes, gzipped bytes)
+_calendar_events = {}  # (shard, leave id, updated_at, name) -> VEVENT text
+calendar_serializer = URLSafeSerializer(app.config['SECRET_KEY'], salt='calendar-feed')
+
+
+def calendar_feed_token(user):
+    """Signed feed token naming the user's shard, id and current calendar secret"""
+    if not user.calendar_token:
+        user.calendar_token = os.urandom(16).hex()
+        db.session.commit()
+    return calendar_serializer.dumps([g.get('shard', DEFAULT_SHARD), user.id, user.calendar_token])
+
+
+def calendar_feed_owner(token):
+    """The user a feed token belongs to, with its shard selected; 404 for bad or revoked tokens"""
+    try:
+        shard, user_id, secret = calendar_serializer.loads(token)
+    except (BadSignature, ValueError):
+        abort(404)
+    if shard not in shard_keys():
+        abort(404)
+    switch_shard(shard)
+    user = db.session.get(User, user_id)
+    if user is None or not user.calendar_token or user.calendar_token != secret:
+        abort(404)
+    return user
+
+
+def bounded_put(cache, key, value, limit):
+    if len(cache) >= limit:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
+def ics_escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def ics_fold(line):
+    """Fold a content line at 75 octets as RFC 5545 requires"""
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        if size + width > (74 if parts else 75):
+            parts.append(current)
+            current, size = '', 0
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def calendar_event(leave, name=None):
+    """VEVENT for one approved leave; department feeds pass the faculty name and omit the reason"""
+    key = (g.get('shard', DEFAULT_SHARD), leave.id, leave.updated_at, name)
+    event = _calendar_events.get(key)
+    if event is None:
+        label = f"{leave.leave_category.title()} leave" + (' (half day)' if leave.leave_type == 'half_day' else '')
+        stamp = leave.updated_at or leave.approved_at or leave.created_at or datetime.utcnow()
+        lines = [
+            'BEGIN:VEVENT',
+            f"UID:leave-{key[0]}-{leave.id}@pce.edu",
+            f"DTSTAMP:{stamp:%Y%m%dT%H%M%SZ}",
+            f"DTSTART;VALUE=DATE:{leave.start_date:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{leave.end_date + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{ics_escape(f'{name} - {label}' if name else label)}",
+        ]
+        if name is None:
+            lines.append(f"DESCRIPTION:{ics_escape(leave.reason)}")
+        lines += ['TRANSP:TRANSPARENT' if name else 'TRANSP:OPAQUE', 'END:VEVENT']
+        event = '\r\n'.join(ics_fold(line) for line in lines)
+        bounded_put(_calendar_events, key, event, app.config['CALENDAR_EVENT_CACHE_SIZE'])
+    return event
+
+
+def calendar_sources(window_start, user_id=None, department=None):
+    """One approved-leave query per table the feed window reaches into"""
+    models = [LeaveRequest]
+    boundary = archived_through()
+    if boundary is not None and window_start <= boundary:
+        models.append(ArchivedLeaveRequest)
+
+    def approved(model, *columns):
+        query = db.session.query(*columns).select_from(model).join(User, User.id == model.user_id).filter(
+            model.status == 'Approved', model.end_date >= window_start
+        )
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        if department is not None:
+            query = query.filter(User.department == department)
+        return query
+
+    return models, approved
+
+
+def calendar_feed_response(feed, title, user_id=None, department=None):
+    """Serve an .ics feed, answering unchanged polls with 304 before anything is rendered
+
+    The ETag is derived from a cheap version query (row count, newest change),
+    so a client that already has the current feed costs one indexed aggregate.
+    When the version moves, only events whose row changed are re-rendered.
     """
+    window_start = date.today() - timedelta(days=app.config['CALENDAR_FEED_HISTORY_DAYS'])
+    models, approved = calendar_sources(window_start, user_id, department)
+    # Department feeds show names, so a renamed colleague is a change too
+    names_changed = [db.func.max(User.updated_at)] if department is not None else []
+    version = tuple(tuple(approved(model, db.func.count(model.id), db.func.max(model.updated_at),
+                                   db.func.max(model.id), *names_changed).one())
+                    for model in models)
+
+    key = (g.get('shard', DEFAULT_SHARD), feed, user_id if department is None else department)
+    etag = hashlib.sha256(repr((key, window_start, version)).encode()).hexdigest()[:32]
+    compressed = 'gzip' in request.accept_encodings
+    if compressed:
+        etag += '-gz'
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        cached = _calendar_feeds.get(key)
+        if cached is None or cached[0] != (window_start, version):
+            events = []
+            for model in models:
+                for leave, name in approved(model, model, User.full_name).order_by(model.start_date):
+                    events.append(calendar_event(leave, name if department is not None else None))
+            body = '\r\n'.join([
+                'BEGIN:VCALENDAR',
+                'VERSION:2.0',
+                'PRODID:-//Pillai College of Engineering//Faculty Leave Portal//EN',
+                'CALSCALE:GREGORIAN',
+                'METHOD:PUBLISH',
+                ics_fold(f"X-WR-CALNAME:{ics_escape(title)}"),
+                *events,
+                'END:VCALENDAR',
+                '',
+            ]).encode('utf-8')
+            cached = ((window_start, version), body, gzip.compress(body, compresslevel=app.config['COMPRESS_LEVEL']))
+            bounded_put(_calendar_feeds, key, cached, app.config['CALENDAR_FEED_CACHE_SIZE'])
+
+        response = make_response(cached[2] if compressed else cached[1])
+        response.headers['Content-Type'] = 'text/calendar; charset=utf-8'
+        if compressed:
+            response.headers['Content-Encoding'] = 'gzip'
+
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['CALENDAR_FEED_MAX_AGE']
+    return response
+
+
+# JSON API
+API_RESOURCES = {}
+REQUEST_COLUMNS = ('id', 'status', 'category', 'type', 'start', 'end', 'days', 'reason',
+                   'created_at', 'approved_at', 'comments')
+QUEUE_COLUMNS = ('id', 'shard', 'faculty', 'department', 'category', 'type', 'start', 'end', 'days',
+                 'reason', 'created_at')
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def api_resource(name, admin=False):
+    """Register a read-only /api/v1/<name> resource, also available inside /api/v1/batch"""
+    def register(func):
+        @functools.wraps(func)
+        def wrapper(args):
+            if admin and current_user.username != 'admin':
+                raise ApiError(403, 'Admin privileges required')
+            return func(args)
+        API_RESOURCES[name] = wrapper
+        return wrapper
+    return register
+
+
+def api_shared(func):
+    """Run a loader once per HTTP request, so resources answered in one batch share its query"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        memo = g.setdefault('api_shared', {})
+        key = (func.__name__,) + args
+        if key not in memo:
+            memo[key] = func(*args)
+        return memo[key]
+    return wrapper
+
+
+def api_int(args, name, default, lowest=None, highest=None):
+    value = args.get(name, default)
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"'{name}' must be an integer")
+    if lowest is not None:
+        value = max(value, lowest)
+    if highest is not None:
+        value = min(value, highest)
+    return value
+
+
+def api_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be a YYYY-MM-DD date")
+
+
+def api_json(data):
+    """Compact JSON: no whitespace, ISO dates, UTF-8 text unescaped"""
+    def encode(value):
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        raise TypeError(f"{type(value).__name__} is not JSON serializable")
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=encode)
+
+
+def api_etag(body):
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+
+
+def api_response(data, status=200):
+    body = api_json(data)
+    response = app.response_class(body, status=status, mimetype='application/json')
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if status != 200:
+        return response
+    response.set_etag(api_etag(body))
+    return response.make_conditional(request)
+
+
+def api_call(name, args):
+    """(status, data or error message) for one resource"""
+    resource = API_RESOURCES.get(name)
+    if resource is None:
+        return 404, f"Unknown resource '{name}'"
+    if not current_user.is_authenticated:
+        return 401, 'Login required'
+    try:
+        return 200, resource(args)
+    except ApiError as error:
+        return error.status, error.message
+
+
+def api_batch_entry(label, entry):
+    """(resource, args, etag) of one /api/v1/batch entry, ApiError(400) when malformed
+
+    Args arrive as JSON, so numbers are turned into the strings the query
+    string would have carried; lists, objects and booleans are rejected.
+    """
+    if not isinstance(entry, dict):
+        raise ApiError(400, 'Expected an object with resource, args and etag')
+    resource = entry.get('resource', label)
+    if not isinstance(resource, str):
+        raise ApiError(400, "'resource' must be a string")
+    etag = entry.get('etag')
+    if etag is not None and not isinstance(etag, str):
+        raise ApiError(400, "'etag' must be a string")
+
+    args = entry.get('args')
+    if args is None:
+        args = {}
+    if not isinstance(args, dict):
+        raise ApiError(400, "'args' must be an object")
+    clean = {}
+    for name, value in args.items():
+        if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+            raise ApiError(400, f"Argument '{name}' must be a string or a number")
+        if value is not None:
+            clean[name] = str(value)
+    return resource, clean, etag
+
+
+def request_row(leave):
+    return [leave.id, leave.status, leave.leave_category, leave.leave_type, leave.start_date, leave.end_date,
+            leave.duration, leave.reason, leave.created_at, leave.approved_at, leave.admin_comments]
+
+
+@api_shared
+def own_leave_requests(user_id):
+    """Every hot request of one faculty member, newest first; balances, requests and calendar share it"""
+    return LeaveRequest.query.filter_by(user_id=user_id).order_by(LeaveRequest.created_at.desc()).all()
+
+
+@api_resource('balances')
+def api_balances(args):
+    categories = {}
+    for category in LEAVE_CATEGORIES:
+        left = getattr(current_user, f'{category}_leave_left') or 0
+        reserved = getattr(current_user, f'{category}_leave_reserved') or 0
+        categories[category] = {
+            'total': getattr(current_user, f'{category}_leave_total'),
+            'used': getattr(current_user, f'{category}_leave_used'),
+            'left': left,
+            'reserved': reserved,
+            'available': left - reserved,
+        }
+    pending = sum(1 for leave in own_leave_requests(current_user.id) if leave.status == 'Pending')
+    return {
+        'year': current_user.current_year,
+        'categories': categories,
+        'pending_requests': pending,
+        'overwork_hours': current_user.overwork_hours,
+        'pending_overwork_hours': current_user.pending_overwork_hours,
+    }
+
+
+@api_resource('requests')
+def api_requests(args):
+    limit = api_int(args, 'limit', 50, lowest=1, highest=500)
+    offset = api_int(args, 'offset', 0, lowest=0)
+    leaves = own_leave_requests(current_user.id)
+    if args.get('status'):
+        leaves = [leave for leave in leaves if leave.status == args['status']]
+    return {'total': len(leaves), 'columns': REQUEST_COLUMNS,
+            'rows': [request_row(leave) for leave in leaves[offset:offset + limit]]}
+
+
+@api_resource('calendar')
+def api_calendar(args):
+    """Approved leave days of one year, as the stats page shows them"""
+    year = api_int(args, 'year', datetime.now().year, lowest=1900, highest=9999)
+    boundary = archived_through()
+    if boundary is None or boundary < date(year, 1, 1):
+        leaves = [leave for leave in own_leave_requests(current_user.id)
+                  if leave.status == 'Approved' and leave.start_date.year == year]
+    else:
+        leaves = approved_leaves(current_user.id, year=year)
+
+    days, monthly = {}, [0] * 12
+    for leave in leaves:
+        current_date = leave.start_date
+        while current_date <= leave.end_date:
+            if current_date.year == year:
+                days.setdefault(current_date.month, set()).add(current_date.day)
+                monthly[current_date.month - 1] += 0.5 if leave.leave_type == 'half_day' else 1
+            current_date += timedelta(days=1)
+    return {'year': year, 'days': {month: sorted(values) for month, values in sorted(days.items())},
+            'monthly_days': monthly}
+
+
+@api_resource('admin/summary', admin=True)
+def api_admin_summary(args):
+    pending, faculty, approved_this_month = admin_dashboard_counts()
+    return {'pending': pending, 'faculty': faculty, 'approved_this_month': approved_this_month}
+
+
+@api_resource('admin/queue', admin=True)
+def api_admin_queue(args):
+    selected = {name: args.get(name) or None for name in PENDING_FACETS}
+    filters = {name: api_date(args, name) for name in ('start_from', 'start_to')}
+    for name in ('min_days', 'max_days'):
+        try:
+            filters[name] = float(args[name]) if args.get(name) not in (None, '') else None
+        except (TypeError, ValueError):
+            raise ApiError(400, f"'{name}' must be a number")
+    page = api_int(args, 'page', 1, lowest=1)
+    per_page = api_int(args, 'per_page', app.config['PENDING_REQUESTS_PER_PAGE'], lowest=1, highest=500)
+
+    rows, facets, total = merged_pending_queue(selected, page=page, per_page=per_page, **filters)
+    return {
+        'total': total,
+        'page': page,
+        'facets': {name: dict(counts) for name, counts in facets.items()},
+        'columns': QUEUE_COLUMNS,
+        'rows': [[row.id, row.shard, row.faculty_name, row.department, row.leave_category, row.leave_type,
+                  row.start_date, row.end_date, row.duration, row.reason, row.created_at] for row in rows],
+    }
+
+
+# Request Profiling
+PROFILE_SETTING_KEYS = ('enabled', 'mode', 'sample_rate', 'routes', 'users')
+PROFILE_FILE_PATTERN = re.compile(
+    r'^(?P<stamp>\d{8}T\d{12})--(?P<endpoint>.+?)--(?P<user>.+?)--(?P<ms>\d+)ms\.(?P<kind>folded|prof)$'
+)
+_profiling_settings = {'checked': 0.0, 'mtime': None, 'values': None}
+
+
+def profiling_settings():
+    """PROFILE_* config overlaid with the admin's saved settings, re-read at most once a second"""
+    now = time.monotonic()
+    if _profiling_settings['values'] is None or now - _profiling_settings['checked'] > 1:
+        _profiling_settings['checked'] = now
+        path = app.config['PROFILE_SETTINGS_FILE']
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        if _profiling_settings['values'] is None or mtime != _profiling_settings['mtime']:
+            values = {key: app.config[f'PROFILE_{key.upper()}'] for key in PROFILE_SETTING_KEYS}
+            if mtime is not None:
+                with open(path, encoding='utf-8') as f:
+                    values.update((key, value) for key, value in json.load(f).items() if key in values)
+            _profiling_settings.update(mtime=mtime, values=values)
+    return _profiling_settings['values']
+
+
+def save_profiling_settings(values):
+    path = app.config['PROFILE_SETTINGS_FILE']
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({key: values[key] for key in PROFILE_SETTING_KEYS}, f, indent=2)
+    os.replace(path + '.tmp', path)
+    _profiling_settings['values'] = None
+
+
+class StackSampler:
+    """Records the stack of one thread every interval from a timer thread
+
+    The profiled code runs untouched, so the cost is the sampler thread waking
+    up, not instrumentation of every call as with cProfile.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed format, readable by flamegraph.pl and speedscope"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def should_profile(settings):
+    if not settings['enabled'] or request.endpoint in (None, 'static', 'fingerprinted_asset'):
+        return False
+    if request.endpoint in settings['routes']:
+        return True
+    if settings['users'] and current_user.is_authenticated and current_user.username in settings['users']:
+        return True
+    return settings['sample_rate'] > 0 and random.random() < settings['sample_rate']
+
+
+# Only one cProfile can be active per interpreter on Python 3.12+, so concurrent
+# requests take turns and the others fall back to stack sampling
+_cprofile_lock = threading.Lock()
+
+
+@app.before_request
+def start_profiling():
+    settings = profiling_settings()
+    if not settings['enabled'] or not should_profile(settings):
+        return
+    if settings['mode'] == 'cprofile' and _cprofile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:  # another profiler (a debugger, say) is already installed
+            _cprofile_lock.release()
+            g.profiler = None
+    if g.get('profiler') is None:
+        g.profiler = StackSampler(threading.get_ident(), app.config['PROFILE_INTERVAL'])
+        g.profiler.start()
+    g.profile_started = time.perf_counter()
+
+
+@app.teardown_request
+def finish_profiling(error=None):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        _cprofile_lock.release()
+    else:
+        profiler.stop()
+    elapsed_ms = (time.perf_counter() - g.pop('profile_started')) * 1000
+
+    user = current_user.username if current_user.is_authenticated else 'anonymous'
+    name = '--'.join([
+        datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'),
+        re.sub(r'[^A-Za-z0-9_.]+', '-', request.endpoint or 'unknown'),
+        re.sub(r'[^A-Za-z0-9_.]+', '-', user),
+        f"{elapsed_ms:.0f}ms",
+    ])
+    folder = app.config['PROFILE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.dump_stats(os.path.join(folder, name + '.prof'))
+    else:
+        with open(os.path.join(folder, name + '.folded'), 'w', encoding='utf-8') as f:
+            f.write(profiler.collapsed())
+
+    # Bounded ring: names start with the capture time, so the oldest sort first
+    captures = sorted(entry for entry in os.listdir(folder) if PROFILE_FILE_PATTERN.match(entry))
+    for stale in captures[:-app.config['PROFILE_MAX_FILES']]:
+        os.remove(os.path.join(folder, stale))
+
+
+def list_profiles():
+    folder = app.config['PROFILE_FOLDER']
+    if not os.path.isdir(folder):
+        return []
+    profiles = []
+    for entry in sorted(os.listdir(folder), reverse=True):
+        match = PROFILE_FILE_PATTERN.match(entry)
+        if match:
+            profiles.append(dict(match.groupdict(), name=entry,
+                                 captured_at=datetime.strptime(match['stamp'], '%Y%m%dT%H%M%S%f'),
+                                 size=os.path.getsize(os.path.join(folder, entry))))
+    return profiles
 
-    return letter_html
+
+# Static Assets
+_asset_manifest = {'mtime': None, 'files': {}}
+
+
+def load_asset_manifest():
+    """Logical static path -> fingerprinted path, reloaded when build-assets rewrites it"""
+    path = os.path.join(app.config['ASSETS_FOLDER'], 'manifest.json')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if mtime != _asset_manifest['mtime']:
+        with open(path, encoding='utf-8') as f:
+            _asset_manifest.update(mtime=mtime, files=json.load(f))
+    return _asset_manifest['files']
+
+
+@app.template_global()
+def asset_url(filename):
+    """URL of the fingerprinted build of a static file, or the plain file before a build"""
+    fingerprinted = load_asset_manifest().get(filename)
+    if fingerprinted is None:
+        return url_for('static', filename=filename)
+    return url_for('fingerprinted_asset', filename=fingerprinted)
+
+
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """Serve a fingerprinted file, preferring a precompressed variant the client accepts"""
+    folder = app.config['ASSETS_FOLDER']
+    served_name, encoding = filename, None
+    for candidate_encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        candidate = safe_join(folder, filename + suffix)
+        if candidate_encoding in request.accept_encodings and candidate and os.path.isfile(candidate):
+            served_name, encoding = filename + suffix, candidate_encoding
+            break
+
+    response = send_from_directory(folder, served_name,
+                                   mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=app.config['ASSETS_MAX_AGE'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Gzip dynamic HTML and JSON responses above COMPRESS_MIN_SIZE"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in app.config['COMPRESS_MIMETYPES']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings:
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=app.config['COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    # A strong ETag names the uncompressed bytes, so downgrade it
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 
 # Routes
@@ -553,6 +2118,7 @@ def login():
         password = request.form['password']
         user_type = request.form.get('user_type', 'faculty')
 
+        switch_shard(find_user_shard(username))
         user = User.query.filter_by(username=username).first()
 
         if user and check_password_hash(user.password_hash, password):
@@ -564,6 +2130,7 @@ def login():
                 return render_template('login.html')
 
             login_user(user)
+            session['shard'] = g.shard
 
             if user_type == 'admin' and username == 'admin':
                 return redirect(url_for('admin_dashboard'))
@@ -578,13 +2145,17 @@ def login():
 @login_required
 def logout():
     logout_user()
+    session.pop('shard', None)
     return redirect(url_for('login'))
 
 
 @app.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html', user=current_user)
+    token = calendar_feed_token(current_user)
+    return render_template('profile.html', user=current_user,
+                           personal_feed_url=url_for('personal_calendar_feed', token=token, _external=True),
+                           department_feed_url=url_for('department_calendar_feed', token=token, _external=True))
 
 
 @app.route('/dashboard')
@@ -613,20 +2184,24 @@ def request_leave():
                 flash('End date must be after start date')
                 return render_template('request_leave.html', user=current_user)
 
+            if leave_category not in LEAVE_CATEGORIES:
+                flash('Invalid leave category')
+                return render_template('request_leave.html', user=current_user)
+
             if leave_type == 'half_day':
                 duration = ((end_date - start_date).days + 1) * 0.5
             else:
                 duration = (end_date - start_date).days + 1
 
-            # Check balance
-            if leave_category == 'medical' and duration > current_user.medical_leave_left:
-                flash(f'Insufficient medical leaves. You have {current_user.medical_leave_left} days left.')
-                return render_template('request_leave.html', user=current_user)
-            elif leave_category == 'casual' and duration > current_user.casual_leave_left:
-                flash(f'Insufficient casual leaves. You have {current_user.casual_leave_left} days left.')
-                return render_template('request_leave.html', user=current_user)
-            elif leave_category == 'earned' and duration > current_user.earned_leave_left:
-                flash(f'Insufficient earned leaves. You have {current_user.earned_leave_left} days left.')
+            # Check balance, counting days already held by pending requests
+            if not reserve_leave(current_user.id, leave_category, duration):
+                db.session.rollback()
+                left = getattr(current_user, f'{leave_category}_leave_left')
+                reserved = getattr(current_user, f'{leave_category}_leave_reserved') or 0
+                message = f'Insufficient {leave_category} leaves. You have {left - reserved} days available'
+                if reserved:
+                    message += f' ({reserved} days held by pending requests)'
+                flash(message + '.')
                 return render_template('request_leave.html', user=current_user)
 
             # Create leave request
@@ -639,7 +2214,9 @@ def request_leave():
                 leave_category=leave_category
             )
             db.session.add(leave)
+            event = record_queue_event('created', leave, current_user)
             db.session.commit()
+            live_bus().publish(event)
 
             flash('Leave request submitted successfully. Awaiting approval.')
             return redirect(url_for('dashboard'))
@@ -782,18 +2359,20 @@ def stats():
                            calendar=calendar)
 
 
+STATUS_ROW_COLUMNS = (
+    LeaveRequest.id, LeaveRequest.status, LeaveRequest.leave_category, LeaveRequest.leave_type,
+    LeaveRequest.start_date, LeaveRequest.end_date, LeaveRequest.reason, LeaveRequest.admin_comments,
+    LeaveRequest.created_at,
+)
+
+
 @app.route('/status')
 @login_required
 def status():
-    requests = LeaveRequest.query.filter_by(user_id=current_user.id).order_by(LeaveRequest.created_at.desc()).all()
-    requests_with_duration = []
-    for req in requests:
-        if hasattr(req, 'leave_type') and req.leave_type == 'half_day':
-            duration = ((req.end_date - req.start_date).days + 1) * 0.5
-        else:
-            duration = (req.end_date - req.start_date).days + 1
-        requests_with_duration.append((req, duration))
-    return render_template('status.html', requests_with_duration=requests_with_duration)
+    leave_requests = db.session.query(*STATUS_ROW_COLUMNS, leave_duration_expression().label('duration')).filter(
+        LeaveRequest.user_id == current_user.id
+    ).order_by(LeaveRequest.created_at.desc()).all()
+    return render_template('status.html', leave_requests=leave_requests)
 
 
 @app.route('/history')
@@ -802,70 +2381,88 @@ def history():
     search_start_date = request.args.get('search_start_date')
     search_end_date = request.args.get('search_end_date')
 
-    query = LeaveRequest.query.filter_by(user_id=current_user.id, status='Approved')
+    start_date = end_date = None
 
     if search_start_date:
         try:
             start_date = datetime.strptime(search_start_date, '%Y-%m-%d').date()
-            query = query.filter(LeaveRequest.start_date >= start_date)
         except ValueError:
             flash('Invalid start date format')
     if search_end_date:
         try:
             end_date = datetime.strptime(search_end_date, '%Y-%m-%d').date()
-            query = query.filter(LeaveRequest.end_date <= end_date)
         except ValueError:
             flash('Invalid end date format')
 
-    history = query.order_by(LeaveRequest.start_date.desc()).all()
-    history_with_duration = []
-    for h in history:
-        if hasattr(h, 'leave_type') and h.leave_type == 'half_day':
-            duration = ((h.end_date - h.start_date).days + 1) * 0.5
-        else:
-            duration = (h.end_date - h.start_date).days + 1
-        history_with_duration.append((h, duration))
-
-    return render_template('history.html', history_with_duration=history_with_duration)
+    history = approved_leaves(current_user.id, start_from=start_date, end_to=end_date)
+    return render_template('history.html', history=history)
 
 
 @app.route('/view_letter/<int:request_id>')
 @login_required
 def view_letter(request_id):
     """Display enhanced leave letter in browser with past records"""
-    leave_request = LeaveRequest.query.get_or_404(request_id)
+    leave_request = LeaveRequest.query.get(request_id) or ArchivedLeaveRequest.query.get_or_404(request_id)
 
     # Check permissions
     if leave_request.user_id != current_user.id and current_user.username != 'admin':
         flash('Access denied.')
         return redirect(url_for('dashboard'))
 
-    faculty = User.query.get(leave_request.user_id)
+    # Decided requests no longer change, so serve the pre-rendered copy when there is one
+    if leave_request.status != 'Pending':
+        entry = latest_stored_letter(leave_request.id)
+        if entry is not None and os.path.exists(letter_blob_path(entry.content_hash)):
+            return stored_letter_response(entry)
 
-    # Get past leave records for the current year
-    current_year = datetime.now().year
-    past_leaves = LeaveRequest.query.filter(
-        LeaveRequest.user_id == faculty.id,
-        LeaveRequest.status == 'Approved',
-        db.extract('year', LeaveRequest.start_date) == current_year
-    ).order_by(LeaveRequest.start_date.desc()).all()
-
-    # Calculate statistics
-    total_medical = sum(leave.duration for leave in past_leaves if leave.leave_category == 'medical')
-    total_casual = sum(leave.duration for leave in past_leaves if leave.leave_category == 'casual')
-    total_earned = sum(leave.duration for leave in past_leaves if leave.leave_category == 'earned')
-
-    # Generate enhanced letter HTML
-    letter_html = generate_enhanced_leave_letter(
-        faculty,
-        leave_request,
-        past_leaves,
-        total_medical,
-        total_casual,
-        total_earned
-    )
+    # Stream the letter so the browser can start on the header and stylesheet early
+    return app.response_class(stream_template('leave_letter.html', **leave_letter_context(leave_request)))
+
+
+@app.route('/calendar/<token>/leaves.ics')
+def personal_calendar_feed(token):
+    """Approved leaves of the token's owner, for calendar apps"""
+    owner = calendar_feed_owner(token)
+    return calendar_feed_response('personal', f"Leaves - {owner.full_name}", user_id=owner.id)
+
+
+@app.route('/calendar/<token>/department.ics')
+def department_calendar_feed(token):
+    """Approved leaves of everyone in the token owner's department; the admin may pick one"""
+    owner = calendar_feed_owner(token)
+    department = owner.department
+    if owner.username == 'admin' and request.args.get('department'):
+        department = request.args['department']
+        switch_shard(shard_for_department(department))
+    return calendar_feed_response('department', f"{department} Department Leaves", department=department)
+
+
+@app.route('/calendar/reset_token', methods=['POST'])
+@login_required
+def reset_calendar_token():
+    current_user.calendar_token = os.urandom(16).hex()
+    db.session.commit()
+    flash('Calendar links reset. Subscribe again with the new links; the old ones no longer work.')
+    return redirect(url_for('profile'))
+
+
+@app.route('/withdraw_request/<int:request_id>', methods=['POST'])
+@login_required
+def withdraw_request(request_id):
+    leave_request = LeaveRequest.query.get_or_404(request_id)
+
+    if leave_request.user_id != current_user.id:
+        flash('Access denied.')
+        return redirect(url_for('status'))
 
-    return letter_html
+    if close_leave_request(leave_request, 'Withdrawn'):
+        event = record_queue_event('withdrawn', leave_request, current_user)
+        db.session.commit()
+        live_bus().publish(event)
+        flash('Leave request withdrawn.')
+    else:
+        flash('Only pending requests can be withdrawn.')
+    return redirect(url_for('status'))
 
 
 @app.route('/change_password', methods=['POST'])
@@ -895,6 +2492,47 @@ def change_password():
         return redirect(url_for('profile'))
 
 
+@app.route('/events')
+@login_required
+def live_events():
+    """Server-sent events: queue changes and counters for admins, own requests and balances for faculty"""
+    audience = None if current_user.username == 'admin' else (g.get('shard', DEFAULT_SHARD), current_user.id)
+    bus = live_bus()
+    subscriber, missed = bus.subscribe(request.headers.get('Last-Event-ID'))
+
+    def stream():
+        try:
+            yield f"retry: {app.config['LIVE_POLL_INTERVAL'] * 3000}\n\n"
+            if missed is None:
+                yield live_message({'kind': 'resync'})
+            for event in missed or []:
+                message = live_message(event, audience)
+                if message:
+                    yield message
+            if audience is None and bus.counters is not None:
+                yield live_message({'kind': 'counters', 'counters': dict(bus.counters)})
+
+            deadline = time.monotonic() + app.config['LIVE_STREAM_SECONDS']
+            while time.monotonic() < deadline and not subscriber.lagged:
+                try:
+                    event = subscriber.events.get(timeout=app.config['LIVE_HEARTBEAT_SECONDS'])
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                message = live_message(event, audience)
+                if message:
+                    yield message
+            if subscriber.lagged:
+                yield live_message({'kind': 'resync'})
+        finally:
+            bus.unsubscribe(subscriber)
+
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # Admin Routes
 @app.route('/admin_dashboard')
 @login_required
@@ -903,13 +2541,7 @@ def admin_dashboard():
         flash('Access denied. Admin privileges required.')
         return redirect(url_for('dashboard'))
 
-    pending_count = LeaveRequest.query.filter_by(status='Pending').count()
-    total_faculty = User.query.filter(User.username != 'admin').count()
-    approved_this_month = LeaveRequest.query.filter(
-        LeaveRequest.status == 'Approved',
-        db.extract('month', LeaveRequest.approved_at) == datetime.now().month,
-        db.extract('year', LeaveRequest.approved_at) == datetime.now().year
-    ).count()
+    pending_count, total_faculty, approved_this_month = admin_dashboard_counts()
 
     return render_template('admin_dashboard.html',
                            user=current_user,
@@ -918,6 +2550,112 @@ def admin_dashboard():
                            approved_this_month=approved_this_month)
 
 
+@app.route('/admin/analytics')
+@login_required
+def admin_analytics():
+    if current_user.username != 'admin':
+        flash('Access denied. Admin privileges required.')
+        return redirect(url_for('dashboard'))
+
+    filters = analytics_filters(request.args)
+    filters.setdefault('status', 'Approved')
+    if request.args.get('status') == 'all':
+        filters.pop('status')
+    trend_by = 'month' if 'year' in filters else 'year'
+    trend = analytics_rows([trend_by], filters)
+    if trend_by == 'month':
+        trend_labels = [calendar.month_abbr[row['month']] for row in trend]
+    else:
+        trend_labels = [str(row['year']) for row in trend]
+
+    available = analytics_rows(['year', 'department'], {})
+    by_department = analytics_rows(['department', 'leave_category'], filters)
+    departments = sorted({row['department'] for row in by_department})
+    department_days = {(row['department'], row['leave_category']): row['days'] for row in by_department}
+
+    return render_template('admin_analytics.html',
+                           user=current_user,
+                           filters=filters,
+                           summary=(analytics_rows([], filters) or [None])[0],
+                           departments=departments,
+                           categories=LEAVE_CATEGORIES,
+                           department_days=department_days,
+                           turnaround=analytics_rows(['department'], filters),
+                           trend=trend,
+                           trend_labels=trend_labels,
+                           all_departments=sorted({row['department'] for row in available}),
+                           years=sorted({row['year'] for row in available}),
+                           refreshed_through=analytics_refreshed_through())
+
+
+@app.route('/admin/analytics.json')
+@login_required
+def admin_analytics_json():
+    if current_user.username != 'admin':
+        return {'error': 'Admin privileges required'}, 403
+
+    group_by = [name for name in request.args.get('group_by', '').split(',') if name]
+    unknown = [name for name in group_by if name not in ANALYTICS_DIMENSIONS]
+    if unknown:
+        return {'error': f"Unknown dimension: {', '.join(unknown)}", 'dimensions': list(ANALYTICS_DIMENSIONS)}, 400
+
+    filters = analytics_filters(request.args)
+    refreshed_through = analytics_refreshed_through()
+    return {'group_by': group_by, 'filters': filters, 'rows': analytics_rows(group_by, filters),
+            'refreshed_through': refreshed_through.isoformat() if refreshed_through else None}
+
+
+@app.route('/admin/profiles', methods=['GET', 'POST'])
+@login_required
+def admin_profiles():
+    if current_user.username != 'admin':
+        flash('Access denied. Admin privileges required.')
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        try:
+            sample_rate = min(max(float(request.form.get('sample_rate') or 0), 0.0), 1.0)
+        except ValueError:
+            flash('Sample rate must be a number between 0 and 1')
+            return redirect(url_for('admin_profiles'))
+        save_profiling_settings({
+            'enabled': request.form.get('enabled') == 'on',
+            'mode': 'cprofile' if request.form.get('mode') == 'cprofile' else 'sample',
+            'sample_rate': sample_rate,
+            'routes': [name.strip() for name in request.form.get('routes', '').split(',') if name.strip()],
+            'users': [name.strip() for name in request.form.get('users', '').split(',') if name.strip()],
+        })
+        flash('Profiling settings saved.')
+        return redirect(url_for('admin_profiles'))
+
+    return render_template('admin_profiles.html',
+                           user=current_user,
+                           settings=profiling_settings(),
+                           profiles=list_profiles(),
+                           max_files=app.config['PROFILE_MAX_FILES'],
+                           endpoints=sorted(rule.endpoint for rule in app.url_map.iter_rules()
+                                            if rule.endpoint not in ('static', 'fingerprinted_asset')))
+
+
+@app.route('/admin/profiles/<name>')
+@login_required
+def admin_profile_file(name):
+    if current_user.username != 'admin':
+        flash('Access denied. Admin privileges required.')
+        return redirect(url_for('dashboard'))
+    if not PROFILE_FILE_PATTERN.match(name):
+        abort(404)
+
+    if name.endswith('.prof') and request.args.get('view') == 'top':
+        path = safe_join(app.config['PROFILE_FOLDER'], name)
+        if not path or not os.path.isfile(path):
+            abort(404)
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats('cumulative').print_stats(40)
+        return report.getvalue(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return send_from_directory(app.config['PROFILE_FOLDER'], name, as_attachment=True)
+
+
 @app.route('/admin/pending_requests')
 @login_required
 def admin_pending_requests():
@@ -925,14 +2663,69 @@ def admin_pending_requests():
         flash('Access denied. Admin privileges required.')
         return redirect(url_for('dashboard'))
 
-    pending_requests = db.session.query(LeaveRequest, User).join(
-        User, LeaveRequest.user_id == User.id
-    ).filter(
-        LeaveRequest.status == 'Pending'
-    ).order_by(LeaveRequest.created_at.desc()).all()
+    selected = {name: request.args.get(name) or None for name in PENDING_FACETS}
+    dates = {}
+    for name in ('start_from', 'start_to'):
+        value = request.args.get(name)
+        if value:
+            try:
+                dates[name] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                flash('Invalid start date format')
+    min_days = request.args.get('min_days', type=float)
+    max_days = request.args.get('max_days', type=float)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['PENDING_REQUESTS_PER_PAGE']
+
+    pending_requests, facets, total = merged_pending_queue(selected, min_days=min_days, max_days=max_days,
+                                                          page=page, per_page=per_page, **dates)
 
     return render_template('admin_pending_requests.html',
                            pending_requests=pending_requests,
+                           facets=facets,
+                           total=total,
+                           page=page,
+                           pages=(total + per_page - 1) // per_page,
+                           user=current_user)
+
+
+@app.route('/admin/search')
+@login_required
+def admin_search():
+    if current_user.username != 'admin':
+        flash('Access denied. Admin privileges required.')
+        return redirect(url_for('dashboard'))
+
+    search_text = request.args.get('q', '').strip()
+    status = request.args.get('status') or None
+    category = request.args.get('category') or None
+    department = request.args.get('department') or None
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_RESULTS_PER_PAGE']
+
+    results, total = [], 0
+    if search_text:
+        # bm25 ranks are per shard, which is close enough to interleave the result pages
+        single_shard = len(shard_keys()) == 1
+        for shard, (rows, shard_total) in fan_out(
+                search_leave_requests, search_text, status, category, department,
+                page if single_shard else 1, per_page if single_shard else page * per_page):
+            results.extend(row + (shard,) for row in rows)
+            total += shard_total
+        results.sort(key=lambda row: row[2])
+        if not single_shard:
+            results = results[(page - 1) * per_page:page * per_page]
+
+    departments = sorted({d for _, shard_departments in fan_out(
+        lambda: [d for (d,) in db.session.query(User.department).distinct()]
+    ) for d in shard_departments})
+
+    return render_template('admin_search.html',
+                           results=results,
+                           total=total,
+                           page=page,
+                           pages=(total + per_page - 1) // per_page,
+                           departments=departments,
                            user=current_user)
 
 
@@ -943,31 +2736,23 @@ def admin_request_details(request_id):
         flash('Access denied. Admin privileges required.')
         return redirect(url_for('dashboard'))
 
-    leave_request = db.session.query(LeaveRequest, User).join(
-        User, LeaveRequest.user_id == User.id
-    ).filter(LeaveRequest.id == request_id).first()
+    request_obj = LeaveRequest.query.get(request_id) or ArchivedLeaveRequest.query.get(request_id)
 
-    if not leave_request:
+    if not request_obj:
         flash('Leave request not found.')
         return redirect(url_for('admin_pending_requests'))
 
-    request_obj, faculty = leave_request
-    leave_history = LeaveRequest.query.filter_by(
-        user_id=faculty.id,
-        status='Approved'
-    ).order_by(LeaveRequest.start_date.desc()).limit(10).all()
-
-    medical_taken = sum([req.duration for req in LeaveRequest.query.filter_by(
-        user_id=faculty.id, status='Approved', leave_category='medical'
-    ).all()])
+    faculty = User.query.get(request_obj.user_id)
+    # History and totals span the archive too, so closed years still count
+    approved = leave_records(lambda model: [model.user_id == faculty.id, model.status == 'Approved'])
+    leave_history = db.session.query(approved).order_by(approved.c.start_date.desc()).limit(10).all()
 
-    casual_taken = sum([req.duration for req in LeaveRequest.query.filter_by(
-        user_id=faculty.id, status='Approved', leave_category='casual'
-    ).all()])
-
-    earned_taken = sum([req.duration for req in LeaveRequest.query.filter_by(
-        user_id=faculty.id, status='Approved', leave_category='earned'
-    ).all()])
+    taken = dict(db.session.query(
+        approved.c.leave_category, db.func.sum(leave_duration_expression(approved.c))
+    ).group_by(approved.c.leave_category).all())
+    medical_taken = taken.get('medical', 0)
+    casual_taken = taken.get('casual', 0)
+    earned_taken = taken.get('earned', 0)
 
     if request_obj.leave_type == 'half_day':
         current_duration = ((request_obj.end_date - request_obj.start_date).days + 1) * 0.5
@@ -994,33 +2779,18 @@ def admin_approve_request(request_id):
     leave_request = LeaveRequest.query.get_or_404(request_id)
     admin_comments = request.form.get('admin_comments', '')
 
-    if leave_request.status != 'Pending':
+    if not close_leave_request(leave_request, 'Approved',
+                               approved_at=datetime.utcnow(), admin_comments=admin_comments):
         flash('This request has already been processed.')
         return redirect(url_for('admin_pending_requests'))
 
-    leave_request.status = 'Approved'
-    leave_request.approved_at = datetime.utcnow()
-    leave_request.admin_comments = admin_comments
-
-    if leave_request.leave_type == 'half_day':
-        duration = ((leave_request.end_date - leave_request.start_date).days + 1) * 0.5
-    else:
-        duration = (leave_request.end_date - leave_request.start_date).days + 1
-
+    # Generate enhanced letter and notify the faculty in the background
     faculty = User.query.get(leave_request.user_id)
-    if leave_request.leave_category == 'medical':
-        faculty.medical_leave_used += duration
-        faculty.medical_leave_left -= duration
-    elif leave_request.leave_category == 'casual':
-        faculty.casual_leave_used += duration
-        faculty.casual_leave_left -= duration
-    elif leave_request.leave_category == 'earned':
-        faculty.earned_leave_used += duration
-        faculty.earned_leave_left -= duration
-
+    enqueue_decision_jobs(leave_request, faculty)
+    event = record_queue_event('approved', leave_request, faculty)
     db.session.commit()
+    live_bus().publish(event)
 
-    # Generate enhanced letter after approval
     flash('Leave request approved successfully!')
     return redirect(url_for('admin_pending_requests'))
 
@@ -1035,13 +2805,15 @@ def admin_reject_request(request_id):
     leave_request = LeaveRequest.query.get_or_404(request_id)
     admin_comments = request.form.get('admin_comments', '')
 
-    if leave_request.status != 'Pending':
+    if not close_leave_request(leave_request, 'Rejected', admin_comments=admin_comments):
         flash('This request has already been processed.')
         return redirect(url_for('admin_pending_requests'))
 
-    leave_request.status = 'Rejected'
-    leave_request.admin_comments = admin_comments
+    faculty = User.query.get(leave_request.user_id)
+    enqueue_decision_jobs(leave_request, faculty)
+    event = record_queue_event('rejected', leave_request, faculty)
     db.session.commit()
+    live_bus().publish(event)
     flash('Leave request rejected.')
     return redirect(url_for('admin_pending_requests'))
 
@@ -1053,27 +2825,846 @@ def admin_faculty_list():
         flash('Access denied. Admin privileges required.')
         return redirect(url_for('dashboard'))
 
-    faculty_list = User.query.filter(User.username != 'admin').all()
-    faculty_stats = []
-    for faculty in faculty_list:
-        approved_leaves = LeaveRequest.query.filter_by(
-            user_id=faculty.id, status='Approved'
-        ).count()
-
-        pending_leaves = LeaveRequest.query.filter_by(
-            user_id=faculty.id, status='Pending'
-        ).count()
-
-        faculty_stats.append({
+    def shard_faculty_stats():
+        records = leave_records(lambda model: [model.status.in_(['Approved', 'Pending'])]).c
+        counts = dict(((user_id, status), count) for user_id, status, count in db.session.query(
+            records.user_id, records.status, db.func.count()
+        ).group_by(records.user_id, records.status))
+        return [{
             'faculty': faculty,
-            'approved_leaves': approved_leaves,
-            'pending_leaves': pending_leaves
-        })
+            'approved_leaves': counts.get((faculty.id, 'Approved'), 0),
+            'pending_leaves': counts.get((faculty.id, 'Pending'), 0)
+        } for faculty in User.query.filter(User.username != 'admin').all()]
+
+    faculty_stats = [stat for _, stats in fan_out(shard_faculty_stats) for stat in stats]
 
     return render_template('admin_faculty_list.html',
                            faculty_stats=faculty_stats,
                            user=current_user)
 
 
+# JSON API Routes
+@app.route('/api/v1/batch', methods=['GET', 'POST'])
+def api_batch():
+    """Answer several resources in one round trip
+
+    POST {"label": {"resource": "requests", "args": {...}, "etag": "..."}, ...}
+    (resource defaults to the label), or GET ?resources=balances,calendar with
+    the query string as shared args. An entry whose etag still matches comes
+    back as status 304 without data, so clients only download what changed.
+    """
+    if request.method == 'POST':
+        spec = request.get_json(silent=True)
+        if not isinstance(spec, dict):
+            return api_response({'error': 'Expected a JSON object of resources'}, 400)
+    else:
+        args = request.args.to_dict()
+        spec = {name: {'args': args} for name in args.pop('resources', '').split(',') if name}
+
+    results = {}
+    for label, entry in spec.items():
+        try:
+            resource, args, client_etag = api_batch_entry(label, entry)
+        except ApiError as error:
+            results[label] = {'status': error.status, 'error': error.message}
+            continue
+        status, payload = api_call(resource, args)
+        if status != 200:
+            results[label] = {'status': status, 'error': payload}
+            continue
+        etag = api_etag(api_json(payload))
+        if client_etag == etag:
+            results[label] = {'status': 304, 'etag': etag}
+        else:
+            results[label] = {'status': 200, 'etag': etag, 'data': payload}
+    return api_response(results)
+
+
+@app.route('/api/v1/<path:resource>')
+def api_get(resource):
+    status, payload = api_call(resource, request.args)
+    if status != 200:
+        return api_response({'error': payload}, status)
+    return api_response(payload)
+
+
+# CLI Commands
+@app.cli.command('rollover-year')
+@click.option('--year', type=int, default=None, help='Academic year to roll into (defaults to the current year).')
+@click.option('--chunk-size', type=int, default=None, help='Users updated per statement.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+@for_each_shard
+def rollover_year(year, chunk_size, dry_run):
+    """Reset medical/casual balances and carry forward earned leave for all users"""
+    year = year or datetime.now().year
+    chunk_size = chunk_size or app.config['ROLLOVER_CHUNK_SIZE']
+    cap = app.config['EARNED_LEAVE_CARRY_FORWARD_CAP']
+    params = {'year': year, 'cap': cap}
+
+    # Users already on the target year are skipped, so re-running after an
+    # interruption only touches the chunks that were not committed yet.
+    pending_filter = "(current_year IS NULL OR current_year < :year)"
+
+    report = db.session.execute(text(f"""
+        SELECT COUNT(*),
+               COALESCE(SUM(CASE WHEN earned_leave_left > :cap THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN earned_leave_left > :cap THEN earned_leave_left - :cap ELSE 0 END), 0),
+               MIN(id), MAX(id)
+        FROM user WHERE {pending_filter}
+    """), params).one()
+    pending_users, capped_users, forfeited_days, min_id, max_id = report
+
+    print(f"Rollover to {year}: {pending_users} users pending")
+    print(f"Earned leave carry-forward cap: {cap} days "
+          f"({capped_users} users capped, {forfeited_days} days forfeited)")
+
+    if dry_run or not pending_users:
+        print("Dry run - no changes written" if dry_run else "Nothing to do")
+        return
+
+    updated = 0
+    for lower in range(min_id, max_id + 1, chunk_size):
+        result = db.session.execute(text(f"""
+            UPDATE user SET
+                medical_leave_used = 0,
+                medical_leave_left = medical_leave_total,
+                casual_leave_used = 0,
+                casual_leave_left = casual_leave_total,
+                earned_leave_total = MIN(earned_leave_left, :cap),
+                earned_leave_used = 0,
+                earned_leave_left = MIN(earned_leave_left, :cap),
+                current_year = :year
+            WHERE id BETWEEN :lower AND :upper AND {pending_filter}
+        """), dict(params, lower=lower, upper=lower + chunk_size - 1))
+        db.session.commit()
+        updated += result.rowcount
+
+    print(f"Rolled over {updated} users to academic year {year}")
+
+
+def expected_balances_query():
+    """Stored balances next to the ones implied by approved requests, one row per user
+
+    Only leaves starting in the user's current academic year count, matching
+    what rollover-year resets. Archived requests are included, since
+    archive-leaves goes by calendar year and can move leave a user has not
+    rolled over from yet.
+    """
+    approved = leave_records(lambda model: [model.status == 'Approved'])
+    records = approved.c
+    duration = leave_duration_expression(records)
+    academic_year = db.func.coalesce(User.current_year, datetime.now().year)
+    approved_days = [
+        db.func.coalesce(db.func.sum(
+            db.case((records.leave_category == category, duration), else_=0)
+        ), 0).label(f'{category}_expected_used')
+        for category in LEAVE_CATEGORIES
+    ]
+    stored = [getattr(User, f'{category}_leave_{field}')
+              for category in LEAVE_CATEGORIES for field in ('total', 'used', 'left')]
+
+    return db.session.query(User.id, User.username, *stored, *approved_days).outerjoin(
+        approved, db.and_(
+            records.user_id == User.id,
+            db.extract('year', records.start_date) == academic_year
+        )
+    ).group_by(User.id)
+
+
+@app.cli.command('reconcile-balances')
+@click.option('--apply', 'apply_fixes', is_flag=True, help='Write the expected balances back to the user table.')
+@click.option('--show', type=int, default=20, help='Mismatched users to print.')
+@for_each_shard
+def reconcile_balances(apply_fixes, show):
+    """Check stored leave balances against approved leave requests"""
+    start = time.perf_counter()
+    checked = 0
+    corrections = []
+    for row in expected_balances_query().yield_per(1000):
+        checked += 1
+        fix = {}
+        for category in LEAVE_CATEGORIES:
+            total = getattr(row, f'{category}_leave_total') or 0
+            expected_used = getattr(row, f'{category}_expected_used')
+            expected = {f'{category}_leave_used': expected_used, f'{category}_leave_left': total - expected_used}
+            for column, value in expected.items():
+                if abs((getattr(row, column) or 0) - value) > 1e-9:
+                    fix[column] = value
+        if fix:
+            if len(corrections) < show:
+                details = ', '.join(f"{column} {getattr(row, column)} -> {value}" for column, value in fix.items())
+                print(f"  {row.username} (id {row.id}): {details}")
+            corrections.append(dict(fix, id=row.id))
+
+    print(f"Checked {checked} users in {time.perf_counter() - start:.2f}s: {len(corrections)} with drifted balances")
+
+    if apply_fixes and corrections:
+        # Rows need different columns, so group by column set for executemany
+        by_columns = {}
+        for fix in corrections:
+            by_columns.setdefault(tuple(sorted(fix)), []).append(fix)
+        for batch in by_columns.values():
+            db.session.execute(db.update(User), batch)
+        db.session.commit()
+        print(f"Corrected balances for {len(corrections)} users")
+
+
+@app.cli.command('archive-leaves')
+@click.option('--before-year', type=int, default=None,
+              help='Archive decided requests that ended before this year (defaults to the current year).')
+@click.option('--chunk-size', type=int, default=None, help='Requests moved per transaction.')
+@for_each_shard
+def archive_leaves(before_year, chunk_size):
+    """Move decided leave requests of closed years from leave_request into the archive table"""
+    before = date(before_year or datetime.now().year, 1, 1)
+    chunk_size = chunk_size or app.config['ARCHIVE_CHUNK_SIZE']
+    # SQLite hands out max(id) + 1 for new rows, so the newest request always stays
+    # hot; otherwise a new request could reuse the id of an archived one.
+    newest = db.session.query(db.func.max(LeaveRequest.id)).scalar()
+    closed = db.and_(LeaveRequest.end_date < before, LeaveRequest.status != 'Pending', LeaveRequest.id != newest)
+
+    started = time.perf_counter()
+    moved = 0
+    while True:
+        ids = [row.id for row in db.session.query(LeaveRequest.id).filter(closed)
+               .order_by(LeaveRequest.id).limit(chunk_size)]
+        if not ids:
+            break
+        # Each chunk is copied and deleted in one transaction, so an interrupted run
+        # leaves every row in exactly one table and can simply be started again.
+        db.session.execute(db.insert(ArchivedLeaveRequest).from_select(
+            ARCHIVED_COLUMNS,
+            db.select(*(LeaveRequest.__table__.c[name] for name in ARCHIVED_COLUMNS))
+            .where(LeaveRequest.id.in_(ids))
+        ))
+        LeaveRequest.query.filter(LeaveRequest.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        moved += len(ids)
+        print(f"  archived {moved} requests")
+
+    elapsed = time.perf_counter() - started
+    rate = moved / elapsed if elapsed else 0
+    print(f"Archived {moved} requests ending before {before} in {elapsed:.2f}s ({rate:.0f} rows/s); "
+          f"{LeaveRequest.query.count()} remain in leave_request")
+
+
+LEGACY_CATEGORY_KEYWORDS = (
+    ('medical', ('medical', 'sick', 'maternity', 'paternity')),
+    ('earned', ('earned', 'privilege', 'annual', 'vacation')),
+    ('casual', ('casual',)),
+)
+LEGACY_STATUSES = {'pending': 'Pending', 'approved': 'Approved', 'rejected': 'Rejected',
+                   'cancelled': 'Withdrawn', 'canceled': 'Withdrawn', 'withdrawn': 'Withdrawn'}
+
+
+def legacy_leave_category(name):
+    """Map a legacy leave_type.name onto medical/casual/earned; unknown types count as casual"""
+    lowered = (name or '').lower()
+    for category, keywords in LEGACY_CATEGORY_KEYWORDS:
+        if any(keyword in lowered for keyword in keywords):
+            return category
+    return 'casual'
+
+
+def legacy_leave_request(row, user_id, category):
+    """Insert values for one legacy leave_request row
+
+    Legacy total_days is an INTEGER, so a half day was stored as 0 (or 0.5 where
+    SQLite kept the real); only a one-day span with such a total is a half day.
+    Everything else is a full-day leave over its dates, whatever total_days says.
+    """
+    start_date = date.fromisoformat(row['start_date'][:10])
+    end_date = date.fromisoformat(row['end_date'][:10])
+    span = (end_date - start_date).days + 1
+    created_at = datetime.fromisoformat(row['created_at']) if row['created_at'] else \
+        datetime(start_date.year, start_date.month, start_date.day)
+    status = (row['status'] or 'pending').lower()
+    return {
+        'user_id': user_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'reason': row['reason'],
+        'status': LEGACY_STATUSES.get(status, status.title()),
+        'leave_type': 'half_day' if span == 1 and row['total_days'] in (0, 0.5) else 'full_day',
+        'leave_category': category,
+        'created_at': created_at,
+        'admin_comments': row['comments'],
+    }
+
+
+def import_legacy_faculty(legacy, chunk_size):
+    """Create a User for every legacy faculty row, matching existing accounts by email
+
+    Emails and usernames are looked up in every shard, since login finds an
+    account in whichever shard has it. A row whose email belongs to an account
+    in another shard, or whose username cannot be made unique, is skipped and
+    reported. Returns {legacy faculty id: (shard, user id)}.
+    """
+    def known_accounts(emails, usernames):
+        return (dict(db.session.query(User.email, User.id).filter(User.email.in_(emails))),
+                {username for (username,) in db.session.query(User.username).filter(User.username.in_(usernames))})
+
+    faculty_map = {}
+    cursor = legacy.execute("""
+        SELECT id, faculty_id, email, password_hash, first_name, last_name, department
+        FROM faculty ORDER BY id
+    """)
+    while rows := cursor.fetchmany(chunk_size):
+        candidates = {row['id']: (row['faculty_id'], f"{row['faculty_id']}-{row['id']}") for row in rows}
+        accounts, taken = {}, set()
+        for shard, (emails, usernames) in fan_out(known_accounts, [row['email'] for row in rows],
+                                                  [name for names in candidates.values() for name in names]):
+            for email, user_id in emails.items():
+                accounts.setdefault(email, {})[shard] = user_id
+            taken |= usernames
+
+        new_users = {}
+        for row in rows:
+            shard = shard_for_department(row['department'])
+            owners = accounts.get(row['email'], {})
+            if shard in owners:
+                faculty_map[row['id']] = (shard, owners[shard])
+                continue
+            if owners:
+                print(f"  Skipped legacy faculty {row['faculty_id']}: {row['email']} belongs to an account "
+                      f"in shard {', '.join(owners)}, not {shard}")
+                continue
+            username = next((name for name in candidates[row['id']] if name not in taken), None)
+            if username is None:
+                print(f"  Skipped legacy faculty {row['faculty_id']}: usernames "
+                      f"{' and '.join(candidates[row['id']])} are already taken")
+                continue
+            taken.add(username)
+            new_users.setdefault(shard, []).append((row['id'], {
+                'username': username,
+                'password_hash': row['password_hash'],
+                'email': row['email'],
+                'full_name': f"{row['first_name']} {row['last_name']}",
+                'department': row['department'],
+            }))
+
+        for shard, shard_users in new_users.items():
+            with use_shard(shard):
+                db.session.execute(db.insert(User), [user for _, user in shard_users])
+                db.session.commit()
+                created = dict(db.session.query(User.email, User.id).filter(
+                    User.email.in_([user['email'] for _, user in shard_users])))
+            for legacy_id, user in shard_users:
+                faculty_map[legacy_id] = (shard, created[user['email']])
+    return faculty_map
+
+
+@app.cli.command('import-legacy')
+@click.option('--source', default=None, help='Legacy database file (defaults to instance/faculty_portal.db).')
+@click.option('--chunk-size', type=int, default=None, help='Legacy rows read and inserted per batch.')
+def import_legacy(source, chunk_size):
+    """Stream faculty and leave requests from the legacy portal database into this one
+
+    Leave requests are imported in legacy id order. Each shard records the last
+    legacy id it committed in the same transaction as the rows, so an
+    interrupted import resumes where it stopped without duplicating anything.
+    """
+    source = os.path.abspath(source or app.config['LEGACY_DATABASE'])
+    chunk_size = chunk_size or app.config['LEGACY_IMPORT_CHUNK_SIZE']
+    legacy = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    legacy.row_factory = sqlite3.Row
+    started = time.perf_counter()
+
+    faculty_map = import_legacy_faculty(legacy, chunk_size)
+    print(f"Mapped {len(faculty_map)} legacy faculty accounts")
+
+    categories = {row['id']: legacy_leave_category(row['name'])
+                  for row in legacy.execute("SELECT id, name FROM leave_type")}
+
+    checkpoints = {}
+    for shard in shard_keys():
+        with use_shard(shard):
+            checkpoint = db.session.get(ImportCheckpoint, (source, 'leave_request'))
+            checkpoints[shard] = checkpoint.last_id if checkpoint else 0
+    resume_from = min(checkpoints.values())
+    if resume_from:
+        print(f"Resuming after legacy leave request {resume_from}")
+
+    imported = skipped = mismatched = approvers_dropped = 0
+    cursor = legacy.execute("""
+        SELECT id, faculty_id, leave_type_id, start_date, end_date, total_days, reason, status, approved_by,
+               comments, created_at
+        FROM leave_request WHERE id > ? ORDER BY id
+    """, (resume_from,))
+    while rows := cursor.fetchmany(chunk_size):
+        by_shard = {}
+        for row in rows:
+            shard, user_id = faculty_map.get(row['faculty_id'], (None, None))
+            if user_id is None:
+                skipped += 1
+            elif row['id'] > checkpoints[shard]:
+                leave = legacy_leave_request(row, user_id, categories.get(row['leave_type_id'], 'casual'))
+                if leave['leave_type'] == 'full_day' and \
+                        row['total_days'] != (leave['end_date'] - leave['start_date']).days + 1:
+                    mismatched += 1
+                if row['approved_by'] is not None:
+                    approvers_dropped += 1
+                by_shard.setdefault(shard, []).append(leave)
+
+        last_id = rows[-1]['id']
+        for shard in shard_keys():
+            with use_shard(shard):
+                if by_shard.get(shard):
+                    db.session.execute(db.insert(LeaveRequest), by_shard[shard])
+                checkpoint = db.session.get(ImportCheckpoint, (source, 'leave_request')) or \
+                    ImportCheckpoint(source=source, entity='leave_request')
+                checkpoint.last_id = last_id
+                db.session.add(checkpoint)
+                db.session.commit()
+            checkpoints[shard] = last_id
+            imported += len(by_shard.get(shard, ()))
+
+        elapsed = time.perf_counter() - started
+        print(f"  {imported} leave requests imported ({imported / elapsed:.0f} rows/s)")
+
+    # Imported pending requests hold days like any other
+    for shard in shard_keys():
+        with use_shard(shard):
+            rebuild_reservations()
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {imported} leave requests in {elapsed:.2f}s ({imported / elapsed:.0f} rows/s); "
+          f"{skipped} skipped without a known faculty member")
+    if mismatched:
+        print(f"{mismatched} leave requests had a legacy total_days that does not match their dates; "
+              f"they were imported as full days over the dates")
+    if approvers_dropped:
+        print(f"{approvers_dropped} legacy approved_by values were not imported: "
+              f"leave requests here do not record who approved them")
+    print("Run 'flask reconcile-balances --apply' to bring leave balances in line with the imported history")
+
+
+@app.cli.command('refresh-analytics')
+@click.option('--full', is_flag=True, help='Rebuild the whole cube, e.g. after faculty changed department.')
+@for_each_shard
+def refresh_analytics(full):
+    """Fold leave requests changed since the last run into the analytics cube"""
+    started = time.perf_counter()
+    cells = refresh_leave_rollup(full=full)
+    print(f"Rebuilt {cells} analytics cells in {time.perf_counter() - started:.2f}s "
+          f"({LeaveRollup.query.count()} cells in cube)")
+
+
+@app.cli.command('verify-reservations')
+@click.option('--apply', 'apply_fixes', is_flag=True, help='Rewrite the counters from pending requests.')
+@for_each_shard
+def verify_reservations(apply_fixes):
+    """Check reserved-days counters against pending leave requests"""
+    corrections = rebuild_reservations(apply_fixes=apply_fixes)
+    for fix in corrections[:20]:
+        print(f"  user {fix['id']}: " + ', '.join(f"{column} -> {value}" for column, value in fix.items() if column != 'id'))
+    print(f"{len(corrections)} users with wrong reservation counters"
+          + (" (corrected)" if apply_fixes and corrections else ""))
+
+
+@app.cli.command('compact-letters')
+@click.option('--retention-days', type=int, default=None, help='Keep superseded letter versions this long.')
+@click.option('--dry-run', is_flag=True, help='Report what would change without writing.')
+def compact_letters(retention_days, dry_run):
+    """Move loose letter files into the store and drop expired versions and orphaned blobs"""
+    retention_days = app.config['LETTER_RETENTION_DAYS'] if retention_days is None else retention_days
+    letters_folder = app.config['LETTERS_FOLDER']
+
+    # 1. Import timestamped letter files written before the store (and sharding) existed
+    imported, imported_bytes = 0, 0
+    loose_files = sorted(os.listdir(letters_folder)) if os.path.isdir(letters_folder) else []
+    for filename in loose_files:
+        match = LEGACY_LETTER_PATTERN.match(filename)
+        if not match:
+            continue
+        path = os.path.join(letters_folder, filename)
+        imported += 1
+        imported_bytes += os.path.getsize(path)
+        if dry_run:
+            continue
+
+        with use_shard(DEFAULT_SHARD), open(path, encoding='utf-8') as f:
+            entry = store_letter(int(match.group(1)), f.read(),
+                                 created_at=datetime.strptime(match.group(2), '%Y%m%d_%H%M%S'))
+            stored_path = os.path.relpath(letter_blob_path(entry.content_hash), app.root_path)
+            LeaveRequest.query.filter(
+                db.func.replace(LeaveRequest.letter_path, '\\', '/') == f"letters/{filename}"
+            ).update({'letter_path': stored_path}, synchronize_session=False)
+            db.session.commit()
+        os.remove(path)
+
+    # 2. Expire superseded versions, always keeping the latest letter per request.
+    # Blobs are shared by every shard, so collect what each shard still references.
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    expired_count, stored_bytes = 0, 0
+    referenced = set()
+    for shard in shard_keys():
+        with use_shard(shard):
+            newer = db.aliased(LetterIndex)
+            superseded = db.session.query(newer.id).filter(
+                newer.request_id == LetterIndex.request_id,
+                newer.created_at > LetterIndex.created_at
+            ).exists()
+            expired = LetterIndex.query.filter(LetterIndex.created_at < cutoff, superseded)
+            expired_count += expired.count()
+            if not dry_run:
+                expired.delete(synchronize_session=False)
+                db.session.commit()
+
+            referenced.update(content_hash for (content_hash,) in
+                              db.session.query(LetterIndex.content_hash).distinct())
+            for (letter_path,) in db.session.query(LeaveRequest.letter_path).filter(
+                    LeaveRequest.letter_path.isnot(None)):
+                referenced.add(os.path.basename(letter_path.replace('\\', '/')).split('.')[0])
+            stored_bytes += db.session.query(db.func.coalesce(db.func.sum(LetterIndex.stored_size), 0)).scalar()
+
+    # 3. Remove blobs that neither an index nor a request's letter_path points at any more
+    orphaned, orphaned_bytes = 0, 0
+    for root, _, files in os.walk(app.config['LETTER_STORE_FOLDER']):
+        for filename in files:
+            if filename.endswith('.html.gz') and filename[:-len('.html.gz')] not in referenced:
+                path = os.path.join(root, filename)
+                orphaned += 1
+                orphaned_bytes += os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+
+    print(f"Imported {imported} loose letter files ({imported_bytes} bytes)")
+    print(f"Expired {expired_count} letter versions older than {retention_days} days")
+    print(f"Removed {orphaned} orphaned blobs ({orphaned_bytes} bytes)")
+    print(f"Letter store index covers {stored_bytes} compressed bytes")
+    if dry_run:
+        print("Dry run - no changes written")
+
+
+@app.cli.command('bench-search')
+@click.option('--rows', type=int, default=50000, help='Synthetic leave requests to generate.')
+@click.option('--repeat', type=int, default=20, help='Timed runs per query.')
+def bench_search(rows, repeat):
+    """Compare the FTS5 index against a LIKE scan on a synthetic in-memory dataset"""
+    conn = sqlite3.connect(':memory:')
+    conn.execute("""CREATE TABLE leave_request (
+        id INTEGER PRIMARY KEY, reason TEXT NOT NULL, admin_comments TEXT, status VARCHAR(20), created_at DATETIME
+    )""")
+    for statement in search_index_ddl('leave_request'):
+        conn.execute(statement)
+
+    rng = random.Random(42)
+    vocabulary = ['family', 'function', 'wedding', 'fever', 'travel', 'exam', 'duty', 'personal', 'work',
+                  'hometown', 'visit', 'medical', 'checkup', 'attending', 'workshop', 'seminar', 'urgent']
+    rare_words = ['conference', 'surgery', 'paternity', 'bereavement']
+    remarks = [None, None, 'Approved', 'Arrange substitute lectures', 'Submit medical certificate']
+
+    def make_reason():
+        words = rng.choices(vocabulary, k=rng.randint(3, 10))
+        if rng.random() < 0.02:
+            words.insert(rng.randrange(len(words)), rng.choice(rare_words))
+        return ' '.join(words)
+
+    start = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO leave_request (reason, admin_comments, status, created_at) VALUES (?, ?, 'Approved', datetime('now'))",
+        ((make_reason(), rng.choice(remarks)) for _ in range(rows))
+    )
+    conn.commit()
+    print(f"Loaded {rows} rows (with index triggers) in {time.perf_counter() - start:.2f}s")
+
+    def timed(sql, params):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = conn.execute(sql, params).fetchall()
+            best = min(best, time.perf_counter() - start)
+        return best * 1000, len(result)
+
+    like_sql = """SELECT id FROM leave_request
+                  WHERE reason LIKE ? OR admin_comments LIKE ? ORDER BY created_at DESC LIMIT 25"""
+    fts_sql = """SELECT leave_request.id FROM leave_request_fts
+                 JOIN leave_request ON leave_request.id = leave_request_fts.rowid
+                 WHERE leave_request_fts MATCH ? ORDER BY bm25(leave_request_fts) LIMIT 25"""
+
+    print(f"{'query':<24}{'LIKE ms':>10}{'FTS5 ms':>10}{'speedup':>10}")
+    for term in rare_words[:2] + ['substitute', 'medical certificate']:
+        like_ms, _ = timed(like_sql, (f'%{term}%', f'%{term}%'))
+        fts_ms, _ = timed(fts_sql, (build_match_query(term),))
+        print(f"{term:<24}{like_ms:>10.2f}{fts_ms:>10.2f}{like_ms / fts_ms:>9.1f}x")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint static files by content hash and precompress them into static/dist"""
+    static_folder = app.static_folder
+    dist_folder = app.config['ASSETS_FOLDER']
+    manifest = {}
+    written = 0
+
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_folder]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(logical)
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            manifest[logical] = fingerprinted
+
+            target = os.path.join(dist_folder, fingerprinted)
+            if os.path.exists(target):
+                continue  # content unchanged since the last build
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            variants = {'': data}
+            if ext.lower() in app.config['PRECOMPRESS_EXTENSIONS']:
+                variants['.gz'] = gzip.compress(data, compresslevel=9, mtime=0)
+                if brotli is not None:
+                    variants['.br'] = brotli.compress(data, quality=11)
+            for suffix, content in variants.items():
+                if suffix and len(content) >= len(data):
+                    continue
+                with open(target + suffix, 'wb') as f:
+                    f.write(content)
+            written += 1
+            sizes = ', '.join(f"{suffix or 'raw'} {len(content)}" for suffix, content in variants.items())
+            print(f"  {logical} -> {fingerprinted} ({sizes} bytes)")
+
+    # Old fingerprinted files stay in place for pages rendered before this build
+    manifest_path = os.path.join(dist_folder, 'manifest.json')
+    os.makedirs(dist_folder, exist_ok=True)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    print(f"Built {written} new assets, manifest lists {len(manifest)} files"
+          + ("" if brotli else " (brotli not installed, gzip only)"))
+
+
+@app.cli.command('bench-letter')
+@click.option('--iterations', type=int, default=2000, help='Letters rendered per measurement.')
+def bench_letter(iterations):
+    """Measure leave letter render time, time to first chunk and allocations"""
+    def sample_leave(day):
+        leave = SimpleNamespace(
+            start_date=date(2026, 1, day), end_date=date(2026, 1, day + 1), leave_type='full_day',
+            leave_category='casual', reason='Attending a family function in my hometown with relatives',
+            status='Approved', approved_at=datetime(2026, 1, 1), admin_comments='Approved'
+        )
+        leave.duration = 2
+        return leave
+
+    context = {
+        'user': SimpleNamespace(full_name='Prof. Sample Faculty', department='Computer Science', username='sample'),
+        'leave_request': sample_leave(1),
+        'past_leaves': [sample_leave(day) for day in range(1, 11)],
+        'duration_text': '2 days',
+        'current_date': '01/01/2026',
+        'academic_year': 2026,
+        'total_medical': 1,
+        'total_casual': 20,
+        'total_earned': 0,
+    }
+
+    def peak_allocations(render):
+        tracemalloc.start()
+        render()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak
+
+    def per_letter_us(render):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            render()
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    from letter_baseline import generate_enhanced_leave_letter
+
+    def baseline():
+        return generate_enhanced_leave_letter(context['user'], context['leave_request'], context['past_leaves'],
+                                              context['total_medical'], context['total_casual'],
+                                              context['total_earned'])
+
+    with app.test_request_context():
+        renderers = [
+            ('f-string (baseline)', baseline),
+            ('template', lambda: render_template('leave_letter.html', **context)),
+            ('template, CSS inlined', lambda: render_template('leave_letter.html', letter_css=letter_stylesheet(),
+                                                              **context)),
+        ]
+        print(f"{'renderer':<24}{'us/letter':>10}{'bytes':>8}{'peak KiB':>10}")
+        for name, render in renderers:
+            size = len(render())  # also warms the template cache
+            print(f"{name:<24}{per_letter_us(render):>10.1f}{size:>8}{peak_allocations(render) / 1024:>10.1f}")
+
+        first_chunk_us = per_letter_us(lambda: next(iter(stream_template('leave_letter.html', **context))))
+    print(f"First streamed chunk of the template: {first_chunk_us:.1f} us/letter "
+          f"(the plain template links the stylesheet, stored letters inline it)")
+
+
+@app.cli.command('bench-profiler')
+@click.option('--requests', 'iterations', type=int, default=2000, help='Requests per measurement.')
+def bench_profiler(iterations):
+    """Measure what the profiling hook costs per request when off, sampling and under cProfile"""
+    saved = {key: app.config[f'PROFILE_{key.upper()}'] for key in PROFILE_SETTING_KEYS}
+    settings_file = app.config['PROFILE_SETTINGS_FILE']
+    folder = app.config['PROFILE_FOLDER']
+    app.config['PROFILE_SETTINGS_FILE'] = os.path.join(folder, 'bench-settings.json')  # ignore admin settings
+    app.config['PROFILE_FOLDER'] = os.path.join(folder, 'bench')
+    client = app.test_client()
+
+    def per_request_us(**overrides):
+        for key in PROFILE_SETTING_KEYS:
+            app.config[f'PROFILE_{key.upper()}'] = overrides.get(key, saved[key])
+        _profiling_settings['values'] = None
+        client.get('/welcome')
+        start = time.perf_counter()
+        for _ in range(iterations):
+            client.get('/welcome')
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    try:
+        with app.test_request_context('/welcome'):
+            _profiling_settings['values'] = None
+            app.config['PROFILE_ENABLED'] = False
+            start = time.perf_counter()
+            for _ in range(iterations * 50):
+                start_profiling()
+            hook_us = (time.perf_counter() - start) / (iterations * 50) * 1e6
+
+        baseline = per_request_us(enabled=False)
+        results = [
+            ('enabled, not selected', per_request_us(enabled=True, sample_rate=0.0, routes=[], users=[])),
+            ('sampling every request', per_request_us(enabled=True, mode='sample', routes=['welcome'])),
+            ('cProfile every request', per_request_us(enabled=True, mode='cprofile', routes=['welcome'])),
+        ]
+    finally:
+        app.config.update({f'PROFILE_{key.upper()}': value for key, value in saved.items()},
+                          PROFILE_SETTINGS_FILE=settings_file, PROFILE_FOLDER=folder)
+        _profiling_settings['values'] = None
+
+    print(f"Disabled hook: {hook_us:.2f} us/request")
+    print(f"Request to /welcome with profiling off: {baseline:.1f} us")
+    for label, us in results:
+        print(f"  {label}: {us:.1f} us ({(us - baseline) / baseline * 100:+.1f}%)")
+
+
+@app.cli.command('bench-list-rows')
+@click.option('--rows', type=int, default=5000, help='Synthetic leave requests listed per page.')
+def bench_list_rows(rows):
+    """Compare full ORM entities with column-projected rows for the queue, status and history lists"""
+    # Synthetic rows go to a scratch database, like bench-search, so no live shard
+    # gets them, fires its search triggers for them or holds its write lock meanwhile
+    with scratch_shard():
+        list_rows_benchmark(rows)
+
+
+def list_rows_benchmark(rows):
+    faculty = User(username='bench.list.rows', password_hash='', email='bench.list.rows@example.invalid',
+                   full_name='Bench Faculty', department='Benchmark',
+                   medical_leave_total=10, medical_leave_left=10, casual_leave_total=10, casual_leave_left=10,
+                   earned_leave_total=0, earned_leave_left=0)
+    db.session.add(faculty)
+    db.session.flush()
+    rng = random.Random(42)
+    first_day = date(datetime.now().year, 1, 1)
+    synthetic = []
+    for index in range(rows):
+        start_date = first_day + timedelta(days=rng.randrange(360))
+        synthetic.append({
+            'user_id': faculty.id, 'start_date': start_date, 'end_date': start_date + timedelta(days=rng.randrange(3)),
+            'reason': 'Attending a family function in my hometown with relatives', 'status': rng.choice(['Pending', 'Approved']),
+            'leave_type': rng.choice(['full_day', 'half_day']), 'leave_category': rng.choice(LEAVE_CATEGORIES),
+        })
+    db.session.execute(db.insert(LeaveRequest), synthetic)
+
+    def measure(load):
+        db.session.expunge_all()
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = load()
+        elapsed = time.perf_counter() - start
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.expunge_all()
+        return result, elapsed * 1000, retained / max(len(result), 1)
+
+    def timed_render(template, **context):
+        start = time.perf_counter()
+        render_template(template, **context)
+        return (time.perf_counter() - start) * 1000
+
+    own = LeaveRequest.query.filter_by(user_id=faculty.id).order_by(LeaveRequest.created_at.desc())
+    approved = LeaveRequest.query.filter_by(user_id=faculty.id, status='Approved').order_by(LeaveRequest.start_date.desc())
+    cases = [
+        ('pending queue',
+         lambda: db.session.query(LeaveRequest, User).join(User, LeaveRequest.user_id == User.id)
+         .filter(LeaveRequest.status == 'Pending').order_by(LeaveRequest.created_at.desc()).all(),
+         lambda: db.session.query(*PENDING_ROW_COLUMNS, leave_duration_expression().label('duration'),
+                                  db.literal(DEFAULT_SHARD).label('shard')).select_from(LeaveRequest)
+         .join(User, LeaveRequest.user_id == User.id).filter(LeaveRequest.status == 'Pending')
+         .order_by(LeaveRequest.created_at.desc()).all(),
+         None),
+        ('status', own.all,
+         lambda: db.session.query(*STATUS_ROW_COLUMNS, leave_duration_expression().label('duration'))
+         .filter(LeaveRequest.user_id == faculty.id).order_by(LeaveRequest.created_at.desc()).all(),
+         ('status.html', 'leave_requests')),
+        ('history', approved.all,
+         lambda: approved_leaves(faculty.id),
+         ('history.html', 'history')),
+    ]
+
+    print(f"{'list':<16}{'rows':>7}{'entity B/row':>14}{'row B/row':>11}{'entity ms':>11}{'row ms':>8}"
+          f"{'render ms':>11}{'row render':>11}")
+    with app.test_request_context():
+        login_user(faculty)
+        for name, load_entities, load_rows, template in cases:
+            entities, entity_ms, entity_bytes = measure(load_entities)
+            light, row_ms, row_bytes = measure(load_rows)
+            render = ''
+            if template:
+                # Entities render through the same template via LeaveRequest.duration
+                file_name, variable = template
+                entity_render = timed_render(file_name, **{variable: own.all() if name == 'status' else approved.all()})
+                row_render = timed_render(file_name, **{variable: light})
+                render = f"{entity_render:>11.1f}{row_render:>11.1f}"
+            print(f"{name:<16}{len(light):>7}{entity_bytes:>14.0f}{row_bytes:>11.0f}{entity_ms:>11.1f}{row_ms:>8.1f}"
+                  + render)
+
+
+@app.cli.command('run-worker')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty instead of polling.')
+def run_worker(once):
+    """Process background jobs from the job table"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Worker {worker_id} started")
+    analytics_due = 0
+    while True:
+        # Analytics refresh here rather than on admin page views
+        if time.monotonic() >= analytics_due:
+            for shard in shard_keys():
+                with use_shard(shard):
+                    cells = refresh_leave_rollup()
+                if cells:
+                    print(f"Analytics {shard}: rebuilt {cells} cells")
+            analytics_due = time.monotonic() + app.config['ANALYTICS_REFRESH_SECONDS']
+
+        # Each shard keeps its own job table, written in the same transaction as the work
+        ran = False
+        for shard in shard_keys():
+            with use_shard(shard):
+                job = claim_job(worker_id)
+                if job is not None:
+                    status = run_job(job)
+                    print(f"Job {shard}/{job.id} ({job.kind}) attempt {job.attempts}: {status}")
+                    ran = True
+
+        if not ran:
+            if once:
+                break
+            db.session.remove()
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+    print(f"Worker {worker_id} stopped")
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,79 @@
+// Live queue updates from /events: counters, pending rows, request statuses and balances
+(function () {
+    const url = document.currentScript.dataset.url;
+    if (!window.EventSource || !document.querySelector(
+            '[data-live-counter], [data-live-request], [data-live-balance], [data-live-notice]')) {
+        return;
+    }
+
+    const STATUS_BADGES = {
+        Approved: ['bg-success', '✅ Approved'],
+        Rejected: ['bg-danger', '❌ Rejected'],
+        Withdrawn: ['bg-secondary', '↩️ Withdrawn'],
+    };
+
+    function badge(status) {
+        const [style, label] = STATUS_BADGES[status];
+        const span = document.createElement('span');
+        span.className = 'badge ' + style;
+        span.textContent = label;
+        return span;
+    }
+
+    function showNotice() {
+        document.querySelectorAll('[data-live-notice]').forEach(notice => notice.classList.remove('d-none'));
+    }
+
+    function updateCounters(counters) {
+        if (!counters) return;
+        document.querySelectorAll('[data-live-counter]').forEach(element => {
+            const value = counters[element.dataset.liveCounter];
+            if (value !== undefined) element.textContent = value;
+        });
+    }
+
+    function updateBalance(event) {
+        if (event.left === null || event.left === undefined) return;
+        document.querySelectorAll(`[data-live-balance="${event.leave_category}"]`).forEach(element => {
+            element.textContent = event.left;
+        });
+        const total = document.querySelector('[data-live-balance="total"]');
+        if (total) {
+            const parts = ['medical', 'casual', 'earned'].map(
+                category => document.querySelector(`[data-live-balance="${category}"]`));
+            if (parts.every(Boolean)) {
+                total.textContent = parts.reduce((sum, part) => sum + parseFloat(part.textContent), 0);
+            }
+        }
+    }
+
+    function decide(event) {
+        const row = document.querySelector(`[data-live-request="${event.shard}:${event.request_id}"]`);
+        if (!row) return;
+        row.classList.add('table-secondary');
+        row.querySelectorAll('[data-live-status]').forEach(cell => cell.replaceChildren(badge(event.status)));
+        row.querySelectorAll('[data-live-actions]').forEach(cell => {
+            const dash = document.createElement('span');
+            dash.className = 'text-muted';
+            dash.textContent = '-';
+            cell.replaceChildren(dash);
+            if (event.status === 'Approved') showNotice();  // the letter link comes with a reload
+        });
+    }
+
+    const source = new EventSource(url);
+    source.addEventListener('counters', message => updateCounters(JSON.parse(message.data).counters));
+    source.addEventListener('resync', showNotice);
+    source.addEventListener('created', message => {
+        const event = JSON.parse(message.data);
+        updateCounters(event.counters);
+        updateBalance(event);
+        showNotice();
+    });
+    ['approved', 'rejected', 'withdrawn'].forEach(kind => source.addEventListener(kind, message => {
+        const event = JSON.parse(message.data);
+        updateCounters(event.counters);
+        updateBalance(event);
+        decide(event);
+    }));
+})();
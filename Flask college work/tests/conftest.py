@@ -0,0 +1,45 @@
+# Test setup: main.py builds its databases at import time, so point it at two
+# throwaway SQLite files (the default shard plus an 'engineering' shard holding
+# Computer Science) before it is imported.
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+DATA_FOLDER = tempfile.mkdtemp(prefix='faculty-leaves-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(DATA_FOLDER, 'default.db')}"
+os.environ['SHARD_DATABASES'] = json.dumps({'engineering': f"sqlite:///{os.path.join(DATA_FOLDER, 'engineering.db')}"})
+os.environ['DEPARTMENT_SHARDS'] = json.dumps({'Computer Science': 'engineering'})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+main.app.config.update(
+    TESTING=True,
+    LETTERS_FOLDER=os.path.join(DATA_FOLDER, 'letters'),
+    LETTER_STORE_FOLDER=os.path.join(DATA_FOLDER, 'letters', 'store'),
+    MAIL_PORT=1,  # nothing listens there, so email jobs fail fast and are retried
+)
+
+
+@pytest.fixture
+def app():
+    return main.app
+
+
+@pytest.fixture
+def login(app):
+    """Return a test client signed in as the given account"""
+    def sign_in(username, password='password123', user_type='faculty'):
+        client = app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password, 'user_type': user_type})
+        assert response.status_code == 302, f'login failed for {username}'
+        return client
+    return sign_in
+
+
+@pytest.fixture
+def admin(login):
+    return login('admin', 'admin123', 'admin')
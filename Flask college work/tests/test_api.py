@@ -0,0 +1,26 @@
+def test_batch_rejects_malformed_entries_one_by_one(login):
+    client = login('smita.joshi')
+    response = client.post('/api/v1/batch', json={
+        'balances': {},
+        'listed': ['requests'],
+        'text': 'requests',
+        'list_args': {'resource': 'requests', 'args': ['page', 2]},
+        'string_args': {'resource': 'requests', 'args': 'page=2'},
+        'nested_arg': {'resource': 'requests', 'args': {'page': {'n': 2}}},
+        'bad_resource': {'resource': ['requests']},
+        'bad_etag': {'resource': 'balances', 'etag': 7},
+        'numeric_args': {'resource': 'requests', 'args': {'page': 1, 'per_page': 5}},
+    })
+    assert response.status_code == 200
+    results = response.get_json()
+
+    assert results['balances']['status'] == 200
+    assert results['numeric_args']['status'] == 200
+    for label in ('listed', 'text', 'list_args', 'string_args', 'nested_arg', 'bad_resource', 'bad_etag'):
+        assert results[label]['status'] == 400, label
+        assert results[label]['error']
+
+
+def test_batch_requires_an_object(login):
+    client = login('smita.joshi')
+    assert client.post('/api/v1/batch', json=['balances']).status_code == 400
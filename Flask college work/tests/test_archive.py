@@ -0,0 +1,59 @@
+import re
+from datetime import date, datetime, timedelta
+
+import main
+from test_sharding import add_user
+
+
+def add_leave(app, shard, user_id, start, days, reason, status='Approved'):
+    with app.app_context(), main.use_shard(shard):
+        leave = main.LeaveRequest(user_id=user_id, start_date=start, end_date=start + timedelta(days=days - 1),
+                                  reason=reason, status=status, leave_type='full_day', leave_category='casual',
+                                  created_at=datetime(start.year, 1, 1))
+        main.db.session.add(leave)
+        main.db.session.commit()
+        return leave.id
+
+
+def archive_old_leaves(app, user_id, reason):
+    """Give the user a 2000 leave and archive it, keeping a pending request (the newest id) hot"""
+    leave_id = add_leave(app, main.DEFAULT_SHARD, user_id, date(2000, 3, 6), 3, reason)
+    add_leave(app, main.DEFAULT_SHARD, user_id, date(2000, 6, 1), 1, 'Still waiting', status='Pending')
+    output = app.test_cli_runner().invoke(args=['archive-leaves', '--before-year', '2001']).output
+    assert 'ending before 2001-01-01' in output
+    with app.app_context():
+        assert main.ArchivedLeaveRequest.query.get(leave_id).reason == reason
+        assert main.LeaveRequest.query.get(leave_id) is None
+    return leave_id
+
+
+def test_reconcile_counts_archived_leave_of_the_current_year(app):
+    # archive-leaves goes by calendar year; this user has not rolled over out of 2000 yet
+    user_id = add_user(app, main.DEFAULT_SHARD, 'archive.reconcile', 'Archives')
+    with app.app_context():
+        main.User.query.filter_by(id=user_id).update(
+            {'current_year': 2000, 'casual_leave_used': 3, 'casual_leave_left': 7})
+        main.db.session.commit()
+    archive_old_leaves(app, user_id, 'Sister wedding upcountry')
+
+    output = app.test_cli_runner().invoke(args=['reconcile-balances', '--show', '100000']).output
+    assert 'Checked' in output
+    assert 'archive.reconcile' not in output
+
+
+def test_archived_requests_stay_searchable_and_counted(app, admin):
+    user_id = add_user(app, main.DEFAULT_SHARD, 'archive.search', 'Archives')
+    leave_id = archive_old_leaves(app, user_id, 'Kumbhmela pilgrimage')
+
+    page = admin.get('/admin/search?q=kumbhmela').get_data(as_text=True)
+    assert 'Kumbhmela pilgrimage' in page
+    assert f'/admin/request_details/{leave_id}' in page
+
+    details = admin.get(f'/admin/request_details/{leave_id}?shard=default')
+    assert details.status_code == 200
+    assert 'Kumbhmela pilgrimage' in details.get_data(as_text=True)
+
+    # The faculty list still counts the archived approval next to the pending request
+    faculty_list = admin.get('/admin/faculty_list').get_data(as_text=True)
+    counts = re.search(r'Prof\. Archive\.Search</strong>.*?bg-success">(\d+)<.*?bg-warning">(\d+)<', faculty_list, re.S)
+    assert counts.groups() == ('1', '1')
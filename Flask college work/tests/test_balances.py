@@ -0,0 +1,73 @@
+from datetime import date, timedelta
+
+import main
+from test_sharding import add_user, shard_rows
+
+
+def casual_balance(username):
+    """(left, used, reserved) casual days as stored"""
+    return shard_rows(main.DEFAULT_SHARD, "SELECT casual_leave_left, casual_leave_used, casual_leave_reserved "
+                      "FROM user WHERE username = ?", username)[0]
+
+
+def submit_leave(client, days_ahead, days, reason):
+    start = date.today() + timedelta(days=days_ahead)
+    return client.post('/request_leave', data={
+        'start_date': start.isoformat(), 'end_date': (start + timedelta(days=days - 1)).isoformat(),
+        'reason': reason, 'leave_type': 'full_day', 'leave_category': 'casual'}, follow_redirects=True)
+
+
+def request_id(reason):
+    return shard_rows(main.DEFAULT_SHARD, 'SELECT id FROM leave_request WHERE reason = ?', reason)[0][0]
+
+
+def test_pending_requests_hold_days_until_decided(app, login, admin):
+    add_user(app, main.DEFAULT_SHARD, 'reserve.submit', 'Balances')
+    client = login('reserve.submit')
+
+    submit_leave(client, 60, 4, 'Reserve four days')
+    assert casual_balance('reserve.submit') == (10, 0, 4)
+
+    # 6 of the 10 days are free while the first request is pending
+    page = submit_leave(client, 70, 7, 'Reserve seven days').get_data(as_text=True)
+    assert 'Insufficient casual leaves. You have 6.0 days available' in page
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT id FROM leave_request WHERE reason = 'Reserve seven days'") == []
+
+    admin.post(f"/admin/reject_request/{request_id('Reserve four days')}?shard=default", data={'admin_comments': 'no'})
+    assert casual_balance('reserve.submit') == (10, 0, 0)
+
+    submit_leave(client, 70, 7, 'Reserve seven days')
+    assert casual_balance('reserve.submit') == (10, 0, 7)
+    client.post(f"/withdraw_request/{request_id('Reserve seven days')}")
+    assert casual_balance('reserve.submit') == (10, 0, 0)
+
+    submit_leave(client, 80, 3, 'Reserve three days')
+    admin.post(f"/admin/approve_request/{request_id('Reserve three days')}?shard=default", data={'admin_comments': 'ok'})
+    assert casual_balance('reserve.submit') == (7, 3, 0)
+
+    # Deciding the same request again must not settle its days twice
+    admin.post(f"/admin/reject_request/{request_id('Reserve three days')}?shard=default", data={'admin_comments': 'no'})
+    assert casual_balance('reserve.submit') == (7, 3, 0)
+
+
+def test_rollover_resets_balances_and_caps_earned_leave(app):
+    user_id = add_user(app, main.DEFAULT_SHARD, 'rollover.year', 'Balances')
+    with app.app_context():
+        main.User.query.filter_by(id=user_id).update({
+            'current_year': 1999, 'casual_leave_used': 4, 'casual_leave_left': 6,
+            'earned_leave_total': 40, 'earned_leave_used': 5, 'earned_leave_left': 35})
+        main.db.session.commit()
+    balances = "SELECT current_year, casual_leave_used, casual_leave_left, earned_leave_total, earned_leave_used, " \
+               "earned_leave_left FROM user WHERE username = 'rollover.year'"
+
+    runner = app.test_cli_runner()
+    runner.invoke(args=['rollover-year', '--year', '2000', '--dry-run'])
+    assert shard_rows(main.DEFAULT_SHARD, balances) == [(1999, 4, 6, 40, 5, 35)]
+
+    output = runner.invoke(args=['rollover-year', '--year', '2000']).output
+    assert '1 users capped, 5 days forfeited' in output
+    assert shard_rows(main.DEFAULT_SHARD, balances) == [(2000, 0, 10, 30, 0, 30)]
+
+    # Re-running after the year has been rolled over leaves the user alone
+    runner.invoke(args=['rollover-year', '--year', '2000'])
+    assert shard_rows(main.DEFAULT_SHARD, balances) == [(2000, 0, 10, 30, 0, 30)]
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+
+import main
+from conftest import DATA_FOLDER
+from test_sharding import shard_rows
+
+LEGACY_SCHEMA = """
+CREATE TABLE faculty (id INTEGER PRIMARY KEY, faculty_id VARCHAR(20) NOT NULL UNIQUE, email VARCHAR(100) NOT NULL UNIQUE,
+    password_hash VARCHAR(255) NOT NULL, first_name VARCHAR(50) NOT NULL, last_name VARCHAR(50) NOT NULL,
+    department VARCHAR(100) NOT NULL, position VARCHAR(100) NOT NULL, phone VARCHAR(15), is_active BOOLEAN,
+    created_at DATETIME);
+CREATE TABLE leave_type (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL, description TEXT, max_days INTEGER NOT NULL);
+CREATE TABLE leave_request (id INTEGER PRIMARY KEY, faculty_id INTEGER NOT NULL, leave_type_id INTEGER NOT NULL,
+    start_date DATE NOT NULL, end_date DATE NOT NULL, total_days INTEGER NOT NULL, reason TEXT NOT NULL,
+    status VARCHAR(8), approved_by INTEGER, comments TEXT, created_at DATETIME);
+"""
+
+
+def test_import_classifies_half_days_from_one_day_spans_only(app):
+    source = os.path.join(DATA_FOLDER, 'faculty_portal.db')
+    with sqlite3.connect(source) as legacy:
+        legacy.executescript(LEGACY_SCHEMA)
+        legacy.execute("INSERT INTO faculty VALUES (1, 'MECH01', 'old.mech@pce.edu', 'x', 'Old', 'Mech', "
+                       "'Mechanical', 'Professor', NULL, 1, NULL)")
+        legacy.execute("INSERT INTO leave_type VALUES (1, 'Casual Leave', '', 10)")
+        legacy.executemany("INSERT INTO leave_request VALUES (?, 1, 1, ?, ?, ?, ?, 'approved', ?, NULL, NULL)", [
+            (1, '2019-03-04', '2019-03-05', 1, 'two days recorded as one', 1),
+            (2, '2019-03-11', '2019-03-11', 0, 'half day stored as 0', None),
+            (3, '2019-03-12', '2019-03-12', 1, 'one full day', None),
+            (4, '2019-03-18', '2019-03-20', 3, 'three days', None),
+        ])
+
+    output = app.test_cli_runner().invoke(args=['import-legacy', '--source', source]).output
+    with app.app_context():
+        types = dict(main.db.session.query(main.LeaveRequest.reason, main.LeaveRequest.leave_type).filter(
+            main.LeaveRequest.reason.in_(['two days recorded as one', 'half day stored as 0',
+                                          'one full day', 'three days'])))
+    assert types == {'two days recorded as one': 'full_day', 'half day stored as 0': 'half_day',
+                     'one full day': 'full_day', 'three days': 'full_day'}
+    assert '1 leave requests had a legacy total_days that does not match' in output
+    assert '1 legacy approved_by values were not imported' in output
+
+
+def test_import_checks_emails_and_usernames_in_every_shard(app):
+    source = os.path.join(DATA_FOLDER, 'legacy_conflicts.db')
+    with sqlite3.connect(source) as legacy:
+        legacy.executescript(LEGACY_SCHEMA)
+        # Mechanical lives in the default shard; both seed accounts live in engineering
+        legacy.executemany("INSERT INTO faculty VALUES (?, ?, ?, 'x', 'Legacy', 'Prof', 'Mechanical', 'Professor', "
+                           "NULL, 1, NULL)", [
+                               (1, 'RG01', 'rashmi.gourkar@pce.edu'),
+                               (2, 'neha.ashok', 'neha.mech@pce.edu'),
+                           ])
+
+    output = app.test_cli_runner().invoke(args=['import-legacy', '--source', source]).output
+    assert 'Skipped legacy faculty RG01: rashmi.gourkar@pce.edu belongs to an account in shard engineering' in output
+    assert 'Mapped 1 legacy faculty accounts' in output
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT username FROM user WHERE email = 'neha.mech@pce.edu'") == \
+        [('neha.ashok-2',)]
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT id FROM user WHERE email = 'rashmi.gourkar@pce.edu'") == []
@@ -0,0 +1,37 @@
+import gzip
+from datetime import date, timedelta
+
+import main
+
+
+def approved_letter(app, login, admin, username, days_ahead):
+    """Submit and approve a leave, render its letter in the worker, return (faculty client, request id)"""
+    faculty = login(username)
+    start = date.today() + timedelta(days=days_ahead)
+    faculty.post('/request_leave', data={'start_date': start.isoformat(), 'end_date': start.isoformat(),
+                                         'reason': 'Workshop', 'leave_type': 'full_day', 'leave_category': 'casual'})
+    with app.app_context(), main.use_shard('engineering'):
+        request_id = main.db.session.query(main.db.func.max(main.LeaveRequest.id)).scalar()
+    admin.post(f'/admin/approve_request/{request_id}?shard=engineering', data={'admin_comments': ''})
+    app.test_cli_runner().invoke(args=['run-worker', '--once'])
+    return faculty, request_id
+
+
+def test_stored_letter_etag_differs_per_encoding(app, login, admin):
+    faculty, request_id = approved_letter(app, login, admin, 'shubhangi.chavan', 60)
+
+    compressed = faculty.get(f'/view_letter/{request_id}', headers={'Accept-Encoding': 'gzip'})
+    plain = faculty.get(f'/view_letter/{request_id}')
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Encoding' not in plain.headers
+    assert gzip.decompress(compressed.data) == plain.data
+    assert b'<style>' in plain.data and b'letter.css' not in plain.data  # self-contained when saved
+
+    compressed_etag, weak = compressed.get_etag()
+    plain_etag, _ = plain.get_etag()
+    assert not weak and compressed_etag == plain_etag + '-gz'
+
+    revalidated = faculty.get(f'/view_letter/{request_id}',
+                              headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{compressed_etag}"'})
+    assert revalidated.status_code == 304
+    assert faculty.get(f'/view_letter/{request_id}', headers={'If-None-Match': f'"{compressed_etag}"'}).status_code == 200
@@ -0,0 +1,50 @@
+import os
+import threading
+
+import pytest
+
+import main
+from conftest import DATA_FOLDER
+
+
+@pytest.fixture
+def cprofile_mode(app, monkeypatch):
+    folder = os.path.join(DATA_FOLDER, 'profiles')
+    monkeypatch.setitem(app.config, 'PROFILE_FOLDER', folder)
+    monkeypatch.setitem(app.config, 'PROFILE_SETTINGS_FILE', os.path.join(DATA_FOLDER, 'profiling.json'))
+    monkeypatch.setitem(main._profiling_settings, 'values', {
+        'enabled': True, 'mode': 'cprofile', 'sample_rate': 0.0, 'routes': ['welcome'], 'users': []})
+    monkeypatch.setitem(main._profiling_settings, 'checked', float('inf'))
+    return folder
+
+
+def captures(folder):
+    return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+
+def test_cprofile_falls_back_to_sampling_while_another_request_holds_it(app, cprofile_mode):
+    assert main._cprofile_lock.acquire(blocking=False)  # as if a concurrent request were being profiled
+    try:
+        assert app.test_client().get('/welcome').status_code == 200
+    finally:
+        main._cprofile_lock.release()
+    assert captures(cprofile_mode)[-1].endswith('.folded')
+
+    assert app.test_client().get('/welcome').status_code == 200
+    assert captures(cprofile_mode)[-1].endswith('.prof')
+    assert not main._cprofile_lock.locked()
+
+
+def test_concurrent_cprofile_requests_all_succeed(app, cprofile_mode):
+    statuses = []
+
+    def fetch():
+        statuses.append(app.test_client().get('/welcome').status_code)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200] * 8
+    assert not main._cprofile_lock.locked()
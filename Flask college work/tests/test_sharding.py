@@ -0,0 +1,117 @@
+import sqlite3
+from datetime import date, timedelta
+
+from flask import g, session
+from werkzeug.security import generate_password_hash
+
+import main
+from conftest import DATA_FOLDER
+
+
+def shard_rows(shard, sql, *params):
+    """Read a shard's SQLite file directly, bypassing the app's routing"""
+    path = f"{DATA_FOLDER}/{'default' if shard == main.DEFAULT_SHARD else shard}.db"
+    with sqlite3.connect(path) as connection:
+        return connection.execute(sql, params).fetchall()
+
+
+def add_user(app, shard, username, department):
+    with app.app_context(), main.use_shard(shard):
+        user = main.User(username=username, password_hash=generate_password_hash('password123'),
+                         email=f'{username}@pce.edu', full_name=f'Prof. {username.title()}', department=department,
+                         medical_leave_total=10, medical_leave_left=10, casual_leave_total=10, casual_leave_left=10,
+                         earned_leave_total=0, earned_leave_left=0)
+        main.db.session.add(user)
+        main.db.session.commit()
+        return user.id
+
+
+def submit_leave(client, days_ahead):
+    start = date.today() + timedelta(days=days_ahead)
+    response = client.post('/request_leave', data={
+        'start_date': start.isoformat(), 'end_date': start.isoformat(), 'reason': f'Leave in {days_ahead} days',
+        'leave_type': 'full_day', 'leave_category': 'casual'})
+    assert response.status_code == 302
+
+
+def test_departments_route_to_their_shard(app):
+    with app.app_context():
+        assert main.shard_for_department('Computer Science') == 'engineering'
+        assert main.shard_for_department('Mechanical') == main.DEFAULT_SHARD
+
+    # Seed accounts were created in their department's file only
+    assert shard_rows('engineering', "SELECT department FROM user WHERE username = 'rashmi.gourkar'") == \
+        [('Computer Science',)]
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT id FROM user WHERE username = 'rashmi.gourkar'") == []
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT id FROM user WHERE username = 'admin'") != []
+
+
+def test_select_shard_pins_faculty_to_their_shard(login):
+    client = login('rashmi.gourkar')
+    with client:
+        client.get('/dashboard')
+        assert g.shard == 'engineering'
+
+        # Only admins may point a request at another shard
+        client.get('/dashboard?shard=default')
+        assert g.shard == 'engineering'
+
+
+def test_login_looks_up_accounts_across_shards(app, login, admin):
+    with app.test_client() as client:
+        client.post('/login', data={'username': 'neha.ashok', 'password': 'password123', 'user_type': 'faculty'})
+        assert session['shard'] == 'engineering'
+    with admin:
+        admin.get('/admin_dashboard')
+        assert session['shard'] == main.DEFAULT_SHARD
+
+    response = app.test_client().post('/login', data={'username': 'nobody', 'password': 'x', 'user_type': 'faculty'})
+    assert response.status_code == 200  # login form again
+
+
+def test_admin_queue_fans_out_and_approves_through_shard_links(app, login, admin):
+    add_user(app, main.DEFAULT_SHARD, 'ravi.mech', 'Mechanical')
+    submit_leave(login('ravi.mech'), 40)
+    submit_leave(login('smita.joshi'), 41)
+
+    page = admin.get('/admin/pending_requests').get_data(as_text=True)
+    assert 'Prof. Ravi.Mech' in page and 'Prof. Smita Joshi' in page
+    assert 'shard=engineering' in page and 'shard=default' in page
+
+    # Request ids overlap between shards, so the ?shard= argument decides which row is approved
+    (engineering_id,) = shard_rows('engineering', "SELECT id FROM leave_request WHERE reason = 'Leave in 41 days'")[0]
+    response = admin.post(f'/admin/approve_request/{engineering_id}?shard=engineering', data={'admin_comments': 'ok'})
+    assert response.status_code == 302
+    assert shard_rows('engineering', 'SELECT status FROM leave_request WHERE id = ?', engineering_id) == [('Approved',)]
+    assert shard_rows(main.DEFAULT_SHARD, "SELECT status FROM leave_request WHERE reason = 'Leave in 40 days'") == \
+        [('Pending',)]
+
+    details = admin.get(f'/admin/request_details/{engineering_id}?shard=engineering').get_data(as_text=True)
+    assert 'Prof. Smita Joshi' in details
+
+
+def test_worker_reports_shard_tagged_job_ids(app, login, admin):
+    submit_leave(login('kirti.rana'), 50)
+    (request_id,) = shard_rows('engineering', "SELECT id FROM leave_request WHERE reason = 'Leave in 50 days'")[0]
+    admin.post(f'/admin/reject_request/{request_id}?shard=engineering', data={'admin_comments': 'no'})
+    jobs = shard_rows('engineering', "SELECT id FROM job WHERE kind = 'send_email' AND attempts = 0")
+    assert jobs
+
+    output = app.test_cli_runner().invoke(args=['run-worker', '--once']).output
+    for (job_id,) in jobs:
+        assert f'Job engineering/{job_id} (send_email)' in output
+    assert 'Job default/' not in output
+
+
+def test_seed_refuses_account_living_in_another_shard(app, caplog):
+    # As left behind by an install that ran before Computer Science got its own shard
+    with app.app_context(), main.use_shard('engineering'):
+        main.User.query.filter_by(username='jaymala.chavan').delete()
+        main.db.session.commit()
+    add_user(app, main.DEFAULT_SHARD, 'jaymala.chavan', 'Computer Science')
+
+    with app.app_context():
+        main.create_faculty_users()
+
+    assert shard_rows('engineering', "SELECT id FROM user WHERE username = 'jaymala.chavan'") == []
+    assert 'already exists in shard default' in caplog.text